@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
 from dotenv import load_dotenv
 from app.database import get_db
 from app.models.user import User
-from app.schemas.user import UserCreate, User
+from app.schemas.user import UserCreate, User as UserSchema
+import asyncio
 import os
+import time
 
 load_dotenv()
 
@@ -19,29 +25,126 @@ if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable is not set")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 行程內使用者快取（每個 worker 各自一份），撤銷 token 後其他 worker 最多延遲 USER_CACHE_TTL 秒生效
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+
+# bcrypt 成本因子，以及密碼雜湊專用執行緒池的大小與允許的排隊上限（含執行中）
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 4))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# passlib（連同 bcrypt 後端）與 jose 於第一次使用時才匯入，縮短 worker 啟動時間
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password, hashed_password):
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+# bcrypt 在雜湊期間釋放 GIL，獨立的執行緒池可避免佔用 AnyIO 預設執行緒池與事件迴圈；
+# 執行緒池於第一次雜湊時建立，關閉應用時由 lifespan 呼叫 shutdown_password_executor
+_password_executor: Optional[ThreadPoolExecutor] = None
+_password_pending = 0
+
+def get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _password_executor
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=True, cancel_futures=True)
+        _password_executor = None
+
+async def run_password_task(func, *args):
+    """在密碼雜湊執行緒池中執行 func；排隊數已達上限時立即回應 429，而不是讓請求無限堆積。"""
+    global _password_pending
+    if _password_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="請求過多，請稍後再試",
+            headers={"Retry-After": "1"},
+        )
+    _password_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_password_executor(), func, *args)
+    finally:
+        _password_pending -= 1
+
+@dataclass(frozen=True, slots=True)
+class CurrentUser:
+    """驗證後的使用者資料，由行程內快取提供，不綁定資料庫 session。"""
+    id: int
+    email: str
+    is_admin: bool
+    created_at: Optional[datetime]
+    token_version: int
+
+    @classmethod
+    def from_model(cls, user: User) -> "CurrentUser":
+        return cls(user.id, user.email, bool(user.is_admin), user.created_at, user.token_version)
+
+_user_cache: OrderedDict[int, tuple[float, CurrentUser]] = OrderedDict()
+
+def cache_user(user: CurrentUser) -> CurrentUser:
+    _user_cache[user.id] = (time.monotonic() + USER_CACHE_TTL, user)
+    _user_cache.move_to_end(user.id)
+    while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+        _user_cache.popitem(last=False)
+    return user
+
+def get_cached_user(user_id: int) -> Optional[CurrentUser]:
+    entry = _user_cache.get(user_id)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if expires_at <= time.monotonic():
+        del _user_cache[user_id]
+        return None
+    return user
+
+def evict_user(user_id: int):
+    _user_cache.pop(user_id, None)
+
+def user_token_data(user: User) -> dict:
+    """token 內容：除 email 外另帶使用者 id 與 token 版本。
+
+    管理員權限不放進 token，一律以快取或資料庫中的使用者為準，取消權限後不必等 token 過期。
+    """
+    return {"sub": user.email, "uid": user.id, "ver": user.token_version}
 
 def create_access_token(data: dict):
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> CurrentUser:
+    """驗證 token 並回傳使用者。
+
+    帶有 uid 的 token 先查行程內快取，命中且 token 版本相符時不查詢資料庫；
+    僅帶 sub 的舊格式 token 仍以 email 查詢。
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="無效的認證憑證",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -49,35 +152,66 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
+    user_id = payload.get("uid")
+    if user_id is None:
+        db_user = await db.scalar(select(User).filter(User.email == email))
+        if db_user is None:
+            raise credentials_exception
+        return CurrentUser.from_model(db_user)
+    user = get_cached_user(user_id)
     if user is None:
+        db_user = await db.get(User, user_id)
+        if db_user is None:
+            raise credentials_exception
+        user = cache_user(CurrentUser.from_model(db_user))
+    if payload.get("ver", 0) != user.token_version:
         raise credentials_exception
     return user
 
-@router.post("/register", response_model=User)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+@router.post("/register", response_model=UserSchema)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).filter(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="電子郵件已被註冊")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await run_password_task(get_password_hash, user.password)
     db_user = User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).filter(User.email == form_data.username))
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await run_password_task(
+            verify_and_update_password, form_data.password, user.hashed_password
+        )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="電子郵件或密碼錯誤",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.email})
+    # 成本因子調整後，於下次登入時以新設定重新雜湊
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    cache_user(CurrentUser.from_model(user))
+    access_token = create_access_token(data=user_token_data(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/users/me", response_model=User)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+@router.post("/logout-all")
+async def logout_all(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """遞增 token 版本，使此使用者先前簽發的所有 token 失效。"""
+    await db.execute(
+        update(User).where(User.id == current_user.id).values(token_version=User.token_version + 1)
+    )
+    await db.commit()
+    evict_user(current_user.id)
+    return {"message": "已登出所有裝置"}
+
+@router.get("/users/me", response_model=UserSchema)
+async def read_users_me(current_user: CurrentUser = Depends(get_current_user)):
     return current_user
\ No newline at end of file
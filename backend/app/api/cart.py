@@ -1,59 +1,264 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, selectinload
-from app.models.cart import CartItem
+from sqlalchemy import or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import Optional
+from app.models.cart import CartItem as CartItemModel
 from app.models.product import Product as ProductModel
-from app.schemas.cart import CartItemCreate, CartItem
+from app.schemas.cart import (
+    CartItemCreate, CartItemUpdate, CartItem, CartBatchRequest, CartOperationResult, CartSummary,
+    CartItemList, CartOperationResultList
+)
+from app.responses import JSONBytesResponse, adapter_response
 from app.database import get_db
-from app.api.auth import get_current_user
-from app.models.user import User
+from app.api.auth import CurrentUser, get_current_user
+from app.api.products import invalidate_product
+from app.reservations import reservation_deadline
+from app.cart_summary import get_cart_summary, invalidate_cart_summary
 
 router = APIRouter()
 
+CART_BATCH_LIMIT = 100
+
+async def reserve_stock(db: AsyncSession, product_id: int, quantity: int) -> bool:
+    """以單一條件式 UPDATE 扣除庫存，庫存不足或產品不存在時不更新任何資料列。"""
+    result = await db.execute(
+        update(ProductModel)
+        .where(ProductModel.id == product_id, ProductModel.stock >= quantity)
+        .values(stock=ProductModel.stock - quantity)
+    )
+    return result.rowcount == 1
+
+async def release_stock(db: AsyncSession, product_id: int, quantity: int):
+    await db.execute(
+        update(ProductModel)
+        .where(ProductModel.id == product_id)
+        .values(stock=ProductModel.stock + quantity)
+    )
+
+async def upsert_cart_item(db: AsyncSession, user_id: int, product_id: int, quantity: int) -> CartItemModel:
+    """以 INSERT ... ON CONFLICT DO UPDATE 新增購物車項目，已存在時累加數量並延長預留期限。"""
+    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(CartItemModel).values(
+        user_id=user_id, product_id=product_id, quantity=quantity, reserved_until=reservation_deadline()
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[CartItemModel.user_id, CartItemModel.product_id],
+        set_={
+            "quantity": CartItemModel.quantity + statement.excluded.quantity,
+            "reserved_until": statement.excluded.reserved_until,
+        },
+    ).returning(CartItemModel)
+    result = await db.scalars(
+        select(CartItemModel).from_statement(statement), execution_options={"populate_existing": True}
+    )
+    return result.one()
+
+async def lock_cart_item(db: AsyncSession, user_id: int, cart_item_id: int) -> Optional[CartItemModel]:
+    """依「產品、購物車項目」的順序鎖定使用者的購物車項目，與其他購物車操作一致以避免死結。"""
+    product_id = await db.scalar(select(CartItemModel.product_id).filter(
+        CartItemModel.id == cart_item_id,
+        CartItemModel.user_id == user_id
+    ))
+    if product_id is None:
+        return None
+    await db.execute(select(ProductModel.id).where(ProductModel.id == product_id).with_for_update())
+    return await db.scalar(select(CartItemModel).filter(
+        CartItemModel.id == cart_item_id,
+        CartItemModel.user_id == user_id
+    ).with_for_update())
+
+async def raise_reservation_error(db: AsyncSession, product_id: int):
+    """扣庫存失敗時區分產品不存在與庫存不足。"""
+    await db.rollback()
+    if await db.scalar(select(ProductModel.id).where(ProductModel.id == product_id)) is None:
+        raise HTTPException(status_code=404, detail="產品不存在")
+    raise HTTPException(status_code=400, detail="庫存不足")
+
 @router.post("/", response_model=CartItem)
 async def add_to_cart(
     cart_item: CartItemCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    product = db.query(ProductModel).filter(ProductModel.id == cart_item.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="產品不存在")
-    if product.stock < cart_item.quantity:
-        raise HTTPException(status_code=400, detail="庫存不足")
-    product.stock -= cart_item.quantity
-    db_cart_item = CartItem(
-        user_id=current_user.id,
-        product_id=cart_item.product_id,
-        quantity=cart_item.quantity
-    )
-    db.add(db_cart_item)
-    db.commit()
-    db.refresh(db_cart_item)
-    db.commit()  # 提交庫存更新
+    if not await reserve_stock(db, cart_item.product_id, cart_item.quantity):
+        await raise_reservation_error(db, cart_item.product_id)
+    db_cart_item = await upsert_cart_item(db, current_user.id, cart_item.product_id, cart_item.quantity)
+    await db.commit()
+    await db.refresh(db_cart_item, ["product"])
+    await invalidate_product(cart_item.product_id)
+    await invalidate_cart_summary(current_user.id)
     return db_cart_item
 
-@router.get("/", response_model=list[CartItem])
+@router.post("/batch", response_model=list[CartOperationResult], response_class=JSONBytesResponse)
+async def batch_update_cart(
+    batch: CartBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """在單一交易中依序套用多個新增/更新/移除操作，並回傳每個操作的結果。
+
+    涉及的產品與購物車項目各以一次 IN 查詢載入並依序鎖定，庫存在記憶體中逐一驗證，
+    失敗的操作不影響其他操作，最後一次提交所有變更。
+    """
+    operations = batch.operations
+    if len(operations) > CART_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"一次最多 {CART_BATCH_LIMIT} 個操作")
+    if not operations:
+        return []
+
+    cart_item_ids = {op.cart_item_id for op in operations if op.cart_item_id is not None}
+    add_product_ids = {op.product_id for op in operations if op.action == "add" and op.product_id is not None}
+    # 與單筆端點相同，先鎖產品再鎖購物車項目，且各依 id 排序，避免並發請求互相死結
+    item_product_ids = set((await db.scalars(
+        select(CartItemModel.product_id).where(
+            CartItemModel.user_id == current_user.id, CartItemModel.id.in_(cart_item_ids)
+        )
+    )).all())
+    products = {
+        product.id: product
+        for product in (await db.scalars(
+            select(ProductModel)
+            .where(ProductModel.id.in_(add_product_ids | item_product_ids))
+            .order_by(ProductModel.id)
+            .with_for_update()
+        )).all()
+    }
+    cart_items = (await db.scalars(
+        select(CartItemModel).where(
+            CartItemModel.user_id == current_user.id,
+            or_(CartItemModel.id.in_(cart_item_ids), CartItemModel.product_id.in_(add_product_ids)),
+        ).order_by(CartItemModel.id).with_for_update()
+    )).all()
+    for item in cart_items:
+        set_committed_value(item, "product", products[item.product_id])
+
+    items_by_id = {item.id: item for item in cart_items}
+    items_by_product = {item.product_id: item for item in cart_items}
+    # 本批次移除的項目延後刪除，同一批次再次新增相同產品時沿用該資料列以免違反唯一索引
+    removed: dict[int, CartItemModel] = {}
+    changed: set[int] = set()
+    reserved_until = reservation_deadline()
+    # 每個操作的 (動作, 失敗原因, 購物車項目)，項目在提交後才序列化（新項目需要 id）
+    results: list[tuple[str, Optional[str], Optional[CartItemModel]]] = []
+
+    for op in operations:
+        if op.action == "add":
+            if op.product_id is None or op.quantity is None:
+                results.append((op.action, "新增操作需要 product_id 與 quantity", None))
+                continue
+            product = products.get(op.product_id)
+            if product is None:
+                results.append((op.action, "產品不存在", None))
+                continue
+            if product.stock < op.quantity:
+                results.append((op.action, "庫存不足", None))
+                continue
+            product.stock -= op.quantity
+            item = items_by_product.get(op.product_id)
+            if item is not None:
+                item.quantity += op.quantity
+            elif op.product_id in removed:
+                item = removed.pop(op.product_id)
+                item.quantity = op.quantity
+            else:
+                item = CartItemModel(user_id=current_user.id, product_id=op.product_id, quantity=op.quantity)
+                item.product = product
+                db.add(item)
+            item.reserved_until = reserved_until
+            items_by_product[op.product_id] = item
+        else:
+            item = items_by_id.get(op.cart_item_id)
+            if item is None or items_by_product.get(item.product_id) is not item:
+                results.append((op.action, "購物車項目不存在", None))
+                continue
+            product = item.product
+            if op.action == "update":
+                if op.quantity is None:
+                    results.append((op.action, "更新操作需要 quantity", None))
+                    continue
+                delta = op.quantity - item.quantity
+                if product.stock < delta:
+                    results.append((op.action, "庫存不足", None))
+                    continue
+                product.stock -= delta
+                item.quantity = op.quantity
+                item.reserved_until = reserved_until
+            else:
+                product.stock += item.quantity
+                removed[item.product_id] = items_by_product.pop(item.product_id)
+                item = None
+        changed.add(product.id)
+        results.append((op.action, None, item))
+
+    for item in removed.values():
+        await db.delete(item)
+    await db.commit()
+    await invalidate_product(*changed)
+    await invalidate_cart_summary(current_user.id)
+    return adapter_response(CartOperationResultList, [
+        {"action": action, "success": detail is None, "detail": detail, "item": item}
+        for action, detail, item in results
+    ], from_attributes=True)
+
+@router.get("/", response_model=list[CartItem], response_class=JSONBytesResponse)
 async def get_cart(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    cart_items = db.query(CartItem).filter(CartItem.user_id == current_user.id).options(selectinload(CartItem.product)).all()
-    return cart_items
+    cart_items = (await db.scalars(
+        select(CartItemModel).filter(CartItemModel.user_id == current_user.id).options(selectinload(CartItemModel.product))
+    )).all()
+    return adapter_response(CartItemList, cart_items, from_attributes=True)
+
+@router.get("/summary", response_model=CartSummary)
+async def get_cart_summary_route(
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """購物車徽章使用的項目數與總價，以 SQL 聚合計算並依使用者快取。"""
+    return await get_cart_summary(db, current_user.id)
+
+@router.put("/{cart_item_id}", response_model=CartItem)
+async def update_cart_item(
+    cart_item_id: int,
+    cart_item: CartItemUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    db_cart_item = await lock_cart_item(db, current_user.id, cart_item_id)
+    if not db_cart_item:
+        raise HTTPException(status_code=404, detail="購物車項目不存在")
+    # 只調整數量差額：增加時條件式扣庫存，減少時歸還庫存
+    delta = cart_item.quantity - db_cart_item.quantity
+    if delta > 0 and not await reserve_stock(db, db_cart_item.product_id, delta):
+        await raise_reservation_error(db, db_cart_item.product_id)
+    if delta < 0:
+        await release_stock(db, db_cart_item.product_id, -delta)
+    db_cart_item.quantity = cart_item.quantity
+    db_cart_item.reserved_until = reservation_deadline()
+    await db.commit()
+    await db.refresh(db_cart_item, ["product"])
+    if delta:
+        await invalidate_product(db_cart_item.product_id)
+        await invalidate_cart_summary(current_user.id)
+    return db_cart_item
 
 @router.delete("/{cart_item_id}")
 async def remove_from_cart(
     cart_item_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    cart_item = db.query(CartItem).filter(
-        CartItem.id == cart_item_id,
-        CartItem.user_id == current_user.id
-    ).first()
+    # 鎖定資料列，避免與清理逾期預留的背景工作同時歸還庫存
+    cart_item = await lock_cart_item(db, current_user.id, cart_item_id)
     if not cart_item:
         raise HTTPException(status_code=404, detail="購物車項目不存在")
-    product = db.query(ProductModel).filter(ProductModel.id == cart_item.product_id).first()
-    product.stock += cart_item.quantity
-    db.delete(cart_item)
-    db.commit()
+    await release_stock(db, cart_item.product_id, cart_item.quantity)
+    await db.delete(cart_item)
+    await db.commit()
+    await invalidate_product(cart_item.product_id)
+    await invalidate_cart_summary(current_user.id)
     return {"message": "已移除購物車項目"}
\ No newline at end of file
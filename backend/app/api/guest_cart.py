@@ -0,0 +1,204 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+import redis.asyncio as redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import Optional
+from dotenv import load_dotenv
+from app import cache
+from app.database import get_db
+from app.api.auth import CurrentUser, get_current_user
+from app.api.cart import reserve_stock, upsert_cart_item
+from app.cart_summary import invalidate_cart_summary
+from app.api.products import PRODUCT_NOT_FOUND, get_cached_product, get_cached_products, invalidate_product
+from app.models.cart import CartItem as CartItemModel
+from app.schemas.cart import CartItemCreate, CartItemUpdate, CartMergeResult, GuestCart, GuestCartItem
+from app.schemas.product import Product
+import os
+import re
+import secrets
+
+load_dotenv()
+
+router = APIRouter()
+
+# 訪客購物車存於 Redis hash（產品 ID -> 數量），每次存取後重新計算 TTL
+GUEST_CART_TTL = int(os.getenv("GUEST_CART_TTL", 7 * 24 * 60 * 60))
+GUEST_CART_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+def guest_cart_key(cart_id: str) -> str:
+    return f"cart:guest:{cart_id}"
+
+def new_guest_cart_id() -> str:
+    return secrets.token_urlsafe(16)
+
+def validate_guest_cart_id(cart_id: Optional[str]) -> Optional[str]:
+    if cart_id is not None and not GUEST_CART_ID_PATTERN.match(cart_id):
+        raise HTTPException(status_code=400, detail="訪客購物車 ID 格式錯誤")
+    return cart_id
+
+def guest_cart_id_header(x_guest_cart_id: Optional[str] = Header(None)) -> Optional[str]:
+    return validate_guest_cart_id(x_guest_cart_id)
+
+def guest_cart_unavailable(e: redis.RedisError) -> HTTPException:
+    print(f"Redis error: {e}, guest cart unavailable")
+    return HTTPException(status_code=503, detail="購物車服務暫時無法使用")
+
+async def read_guest_cart(cart_id: str) -> dict[int, int]:
+    """讀取訪客購物車並延長 TTL，回傳產品 ID -> 數量。"""
+    key = guest_cart_key(cart_id)
+    try:
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.expire(key, GUEST_CART_TTL)
+            entries, _ = await pipe.execute()
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    return {int(product_id): int(quantity) for product_id, quantity in entries.items()}
+
+async def claim_guest_cart(cart_id: str) -> dict[int, int]:
+    """以單一交易讀取並刪除訪客購物車，同一購物車的並發合併只有一個請求取得內容。"""
+    key = guest_cart_key(cart_id)
+    try:
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            entries, _ = await pipe.execute()
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    return {int(product_id): int(quantity) for product_id, quantity in entries.items()}
+
+async def restore_guest_cart(cart_id: str, quantities: dict[int, int]):
+    """合併失敗時將取出的項目加回訪客購物車（與期間新增的項目累加）。"""
+    key = guest_cart_key(cart_id)
+    try:
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            for product_id, quantity in quantities.items():
+                pipe.hincrby(key, product_id, quantity)
+            pipe.expire(key, GUEST_CART_TTL)
+            await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, guest cart not restored")
+
+async def render_guest_cart(cart_id: Optional[str], db: AsyncSession) -> GuestCart:
+    """以產品快取（MGET）補上產品資料，已下架的產品不列出。"""
+    if cart_id is None:
+        return GuestCart()
+    quantities = await read_guest_cart(cart_id)
+    payloads = await get_cached_products(list(quantities), db) if quantities else {}
+    items = [
+        GuestCartItem(
+            id=product_id,
+            product_id=product_id,
+            quantity=quantities[product_id],
+            product=Product.model_validate_json(payload),
+        )
+        for product_id, payload in payloads.items()
+        if payload != PRODUCT_NOT_FOUND
+    ]
+    return GuestCart(cart_id=cart_id, items=items)
+
+async def check_stock(product_id: int, quantity: int, db: AsyncSession):
+    """訪客購物車不預留庫存，只依產品快取確認產品存在且目前庫存足夠。"""
+    payload = await get_cached_product(product_id, db)
+    if payload == PRODUCT_NOT_FOUND:
+        raise HTTPException(status_code=404, detail="產品不存在")
+    if Product.model_validate_json(payload).stock < quantity:
+        raise HTTPException(status_code=400, detail="庫存不足")
+
+@router.get("/", response_model=GuestCart)
+async def get_guest_cart(
+    cart_id: Optional[str] = Depends(guest_cart_id_header),
+    db: AsyncSession = Depends(get_db)
+):
+    return await render_guest_cart(cart_id, db)
+
+@router.post("/", response_model=GuestCart)
+async def add_to_guest_cart(
+    cart_item: CartItemCreate,
+    cart_id: Optional[str] = Depends(guest_cart_id_header),
+    db: AsyncSession = Depends(get_db)
+):
+    """加入訪客購物車；未帶 X-Guest-Cart-Id 時建立新的購物車並於回應中回傳其 ID。"""
+    cart_id = cart_id or new_guest_cart_id()
+    key = guest_cart_key(cart_id)
+    try:
+        current = int(await cache.redis_client.hget(key, cart_item.product_id) or 0)
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    await check_stock(cart_item.product_id, current + cart_item.quantity, db)
+    try:
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, cart_item.product_id, cart_item.quantity)
+            pipe.expire(key, GUEST_CART_TTL)
+            await pipe.execute()
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    return await render_guest_cart(cart_id, db)
+
+@router.put("/{product_id}", response_model=GuestCart)
+async def update_guest_cart_item(
+    product_id: int,
+    cart_item: CartItemUpdate,
+    cart_id: Optional[str] = Depends(guest_cart_id_header),
+    db: AsyncSession = Depends(get_db)
+):
+    if cart_id is None or product_id not in await read_guest_cart(cart_id):
+        raise HTTPException(status_code=404, detail="購物車項目不存在")
+    await check_stock(product_id, cart_item.quantity, db)
+    try:
+        await cache.redis_client.hset(guest_cart_key(cart_id), product_id, cart_item.quantity)
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    return await render_guest_cart(cart_id, db)
+
+@router.delete("/{product_id}", response_model=GuestCart)
+async def remove_from_guest_cart(
+    product_id: int,
+    cart_id: Optional[str] = Depends(guest_cart_id_header),
+    db: AsyncSession = Depends(get_db)
+):
+    if cart_id is None:
+        raise HTTPException(status_code=404, detail="購物車項目不存在")
+    try:
+        removed = await cache.redis_client.hdel(guest_cart_key(cart_id), product_id)
+    except redis.RedisError as e:
+        raise guest_cart_unavailable(e)
+    if not removed:
+        raise HTTPException(status_code=404, detail="購物車項目不存在")
+    return await render_guest_cart(cart_id, db)
+
+@router.post("/merge", response_model=CartMergeResult)
+async def merge_guest_cart(
+    cart_id: Optional[str] = Depends(guest_cart_id_header),
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """登入後將訪客購物車併入會員購物車：此時才預留庫存，並在單一交易中寫入資料庫。
+
+    庫存不足或已下架的產品不併入，其產品 ID 列於 skipped。
+    """
+    # 先取出並刪除訪客購物車再預留庫存，重複送出的合併請求不會重複預留
+    quantities = await claim_guest_cart(cart_id) if cart_id is not None else {}
+    merged, skipped = [], []
+    try:
+        for product_id, quantity in sorted(quantities.items()):
+            if await reserve_stock(db, product_id, quantity):
+                await upsert_cart_item(db, current_user.id, product_id, quantity)
+                merged.append(product_id)
+            else:
+                skipped.append(product_id)
+        await db.commit()
+    except BaseException:
+        if quantities:
+            await restore_guest_cart(cart_id, quantities)
+        raise
+    await invalidate_product(*merged)
+    await invalidate_cart_summary(current_user.id)
+    cart_items = (await db.scalars(
+        select(CartItemModel)
+        .filter(CartItemModel.user_id == current_user.id)
+        .options(selectinload(CartItemModel.product))
+        .execution_options(populate_existing=True)
+    )).all()
+    return CartMergeResult(items=cart_items, skipped=skipped)
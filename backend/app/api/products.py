@@ -1,94 +1,274 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal, Optional, Union
 from app.models.product import Product as ProductModel
-from app.schemas.product import Product, ProductCreate
+from app.schemas.product import Product, ProductCreate, ProductPage, ProductSuggestion, ProductSuggestionList
+from app.pagination import keyset_paginate, next_cursor
+from app.records import PRODUCT_COLUMNS, product_records
+from app.responses import JSONBytesResponse, adapter_response, conditional_response
+from app.search import (
+    full_text_search, fuzzy_search, apply_similarity_threshold, search_terms, trigram_index, prefix_index
+)
 from app.database import get_db
-from app.api.auth import get_current_user
-from app.models.user import User
-from app.cache import cache, redis_client
+from app.api.auth import CurrentUser, get_current_user
+from app.cart_summary import invalidate_all_cart_summaries
+from app.cache import (
+    cache, cache_get, cache_set, cache_get_many, cache_set_many, cache_delete, single_flight,
+    invalidate_namespace, LOCAL_CACHE_TTL
+)
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
 
 router = APIRouter()
 
+PRODUCTS_NAMESPACE = "products"
+
+PRODUCT_CACHE_TIMEOUT = 300
+PRODUCT_NOT_FOUND_TIMEOUT = 30
+# 負向快取標記：產品不存在
+PRODUCT_NOT_FOUND = b"null"
+PRODUCT_BATCH_LIMIT = 100
+# 瀏覽器與 CDN 的快取時間；過期後仍可先使用舊內容並於背景以 If-None-Match 重新驗證
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", 30))
+CATALOG_STALE_WHILE_REVALIDATE = int(os.getenv("CATALOG_STALE_WHILE_REVALIDATE", 60))
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate={CATALOG_STALE_WHILE_REVALIDATE}"
+SUGGEST_LIMIT = 20
+# 可用於游標分頁的排序欄位
+SORT_COLUMNS = {
+    "id": ProductModel.id,
+    "price": ProductModel.price,
+    "name": ProductModel.name,
+}
+ProductSort = Literal["id", "price", "name"]
+
 async def clear_cache():
-    keys = await redis_client.keys("app.api.products:get_products:*")
-    if keys:
-        await redis_client.delete(*keys)
+    await invalidate_namespace(PRODUCTS_NAMESPACE)
+
+def product_cache_key(product_id: int) -> str:
+    return f"app.api.products:product:{product_id}"
+
+async def invalidate_product(*product_ids: int):
+    """僅清除指定產品的快取（含負向快取），供產品與購物車的寫入操作呼叫。"""
+    if product_ids:
+        await cache_delete(*(product_cache_key(product_id) for product_id in product_ids))
+
+def serialize_product(db_product: ProductModel) -> bytes:
+    return Product.model_validate(db_product).model_dump_json().encode()
+
+async def get_cached_product(product_id: int, db: AsyncSession) -> bytes:
+    """回傳產品的 JSON 內容，不存在時回傳 PRODUCT_NOT_FOUND。"""
+    key = product_cache_key(product_id)
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+
+    async def fill() -> bytes:
+        db_product = await db.get(ProductModel, product_id)
+        if db_product is None:
+            await cache_set(key, PRODUCT_NOT_FOUND, PRODUCT_NOT_FOUND_TIMEOUT)
+            return PRODUCT_NOT_FOUND
+        payload = serialize_product(db_product)
+        await cache_set(key, payload, PRODUCT_CACHE_TIMEOUT)
+        return payload
+
+    return await single_flight(key, fill)
+
+async def get_cached_products(product_ids: list[int], db: AsyncSession) -> dict[int, bytes]:
+    """以一次 MGET 讀取多個產品的 JSON 內容，未命中的產品以單一 IN 查詢補齊並以 pipeline 寫回。
+
+    回傳的字典依 product_ids 的順序排列，不存在的產品對應 PRODUCT_NOT_FOUND。
+    """
+    cached = await cache_get_many([product_cache_key(product_id) for product_id in product_ids])
+    payloads = dict(zip(product_ids, cached))
+    missing = [product_id for product_id, payload in payloads.items() if payload is None]
+    if missing:
+        fresh = {}
+        db_products = await db.scalars(select(ProductModel).where(ProductModel.id.in_(missing)))
+        for db_product in db_products:
+            payloads[db_product.id] = serialize_product(db_product)
+            fresh[product_cache_key(db_product.id)] = (payloads[db_product.id], PRODUCT_CACHE_TIMEOUT)
+        for product_id in missing:
+            if payloads[product_id] is None:
+                payloads[product_id] = PRODUCT_NOT_FOUND
+                fresh[product_cache_key(product_id)] = (PRODUCT_NOT_FOUND, PRODUCT_NOT_FOUND_TIMEOUT)
+        await cache_set_many(fresh)
+    return payloads
 
-@router.get("/", response_model=list[Product])
-@cache(timeout=60)
+async def list_products(query, skip: int, limit: int, sort: str, paginate: str, after: Optional[str], db: AsyncSession):
+    """offset 模式回傳產品列表；cursor 模式（或帶有 after）回傳含 next_cursor 的分頁。
+
+    query 應只選取 PRODUCT_COLUMNS，資料列直接轉為 ProductRecord 交由 orjson 序列化。
+    """
+    if paginate == "cursor" or after is not None:
+        query = keyset_paginate(query, SORT_COLUMNS[sort], ProductModel.id, sort, after, limit)
+        products = product_records(await db.execute(query))
+        return {"items": products, "next_cursor": next_cursor(products, sort, limit)}
+    query = query.order_by(SORT_COLUMNS[sort], ProductModel.id).offset(skip).limit(limit)
+    return product_records(await db.execute(query))
+
+@router.get("/", response_model=Union[list[Product], ProductPage], response_class=JSONBytesResponse)
+@cache(
+    timeout=60,
+    key_params=("skip", "limit", "sort", "paginate", "after"),
+    local_timeout=LOCAL_CACHE_TTL,
+    namespace=PRODUCTS_NAMESPACE,
+    cache_control=CATALOG_CACHE_CONTROL,
+)
 async def get_products(
+    request: Request,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    sort: ProductSort = "id",
+    paginate: Literal["offset", "cursor"] = "offset",
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    return JSONBytesResponse(await list_products(select(*PRODUCT_COLUMNS), skip, limit, sort, paginate, after, db))
+
+async def fuzzy_search_products(
+    name: str, skip: int, limit: int, paginate: str, after: Optional[str], db: AsyncSession
 ):
-    products = db.execute(select(ProductModel).offset(skip).limit(limit)).scalars().all()
-    return products
+    """依名稱相似度排序的容錯搜尋；SQLite 環境使用行程內三元組索引。"""
+    if paginate == "cursor" or after is not None:
+        raise HTTPException(status_code=400, detail="相關性排序不支援游標分頁")
+    if db.bind.dialect.name == "postgresql":
+        await apply_similarity_threshold(db)
+        return product_records(await db.execute(fuzzy_search(select(*PRODUCT_COLUMNS), name).offset(skip).limit(limit)))
+    product_ids = [product_id for product_id, _ in trigram_index.search(name)[skip:skip + limit]]
+    if not product_ids:
+        return []
+    products = {
+        product.id: product
+        for product in product_records(
+            await db.execute(select(*PRODUCT_COLUMNS).where(ProductModel.id.in_(product_ids)))
+        )
+    }
+    return [products[product_id] for product_id in product_ids if product_id in products]
 
-@router.get("/search", response_model=list[Product])
+@router.get("/search", response_model=Union[list[Product], ProductPage], response_class=JSONBytesResponse)
 async def search_products(
     name: str = "",
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    sort: Literal["relevance", "id", "price", "name"] = "relevance",
+    paginate: Literal["offset", "cursor"] = "offset",
+    after: Optional[str] = None,
+    mode: Literal["fulltext", "fuzzy"] = "fulltext",
+    db: AsyncSession = Depends(get_db)
+):
+    query = select(*PRODUCT_COLUMNS)
+    if not search_terms(name):
+        sort = "id" if sort == "relevance" else sort
+        return JSONBytesResponse(await list_products(query, skip, limit, sort, paginate, after, db))
+    if mode == "fuzzy":
+        return JSONBytesResponse(await fuzzy_search_products(name, skip, limit, paginate, after, db))
+    query, rank = full_text_search(query, name, db.bind.dialect.name)
+    if sort != "relevance":
+        return JSONBytesResponse(await list_products(query, skip, limit, sort, paginate, after, db))
+    if paginate == "cursor" or after is not None:
+        raise HTTPException(status_code=400, detail="相關性排序不支援游標分頁")
+    query = query.order_by(rank, ProductModel.id).offset(skip).limit(limit)
+    return JSONBytesResponse(product_records(await db.execute(query)))
+
+@router.get("/suggest", response_model=list[ProductSuggestion], response_class=JSONBytesResponse)
+async def suggest_products(
+    q: str = "",
+    limit: int = Query(10, ge=1, le=SUGGEST_LIMIT)
 ):
-    query = select(ProductModel).filter(ProductModel.name.ilike(f"%{name}%")).offset(skip).limit(limit)
-    products = db.execute(query).scalars().all()
-    return products
+    # 索引由背景工作載入與重建，請求只讀取行程內索引
+    return adapter_response(
+        ProductSuggestionList,
+        [{"id": product_id, "name": name} for product_id, name in prefix_index.search(q, limit)],
+    )
+
+@router.get("/batch", response_model=list[Product])
+async def get_products_batch(
+    ids: str = Query(..., description="以逗號分隔的產品 ID"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        # 去除重複並保留請求順序
+        product_ids = list(dict.fromkeys(int(product_id) for product_id in ids.split(",") if product_id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="產品 ID 格式錯誤")
+    if len(product_ids) > PRODUCT_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"一次最多查詢 {PRODUCT_BATCH_LIMIT} 個產品")
+    if not product_ids:
+        return JSONBytesResponse(b"[]")
+
+    payloads = await get_cached_products(product_ids, db)
+    found = [payload for payload in payloads.values() if payload != PRODUCT_NOT_FOUND]
+    return JSONBytesResponse(b"[" + b",".join(found) + b"]")
 
 @router.post("/", response_model=Product)
 async def create_product(
     product: ProductCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="僅管理員可新增產品")
-    db_product = ProductModel(**product.dict())
+    db_product = ProductModel(**product.model_dump())
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await db.commit()
+    await db.refresh(db_product)
     await clear_cache()
+    await invalidate_product(db_product.id)
+    trigram_index.add(db_product.id, db_product.name)
+    prefix_index.add(db_product.id, db_product.name)
     return db_product
 
 @router.get("/{product_id}", response_model=Product)
-async def read_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
-    if db_product is None:
+async def read_product(product_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    payload = await get_cached_product(product_id, db)
+    if payload == PRODUCT_NOT_FOUND:
         raise HTTPException(status_code=404, detail="產品不存在")
-    return db_product
+    return conditional_response(request, payload, CATALOG_CACHE_CONTROL)
 
 @router.put("/{product_id}", response_model=Product)
 async def update_product(
     product_id: int,
     product: ProductCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="僅管理員可更新產品")
-    db_product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
+    db_product = await db.get(ProductModel, product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="產品不存在")
-    for key, value in product.dict().items():
+    price_changed = db_product.price != product.price
+    for key, value in product.model_dump().items():
         setattr(db_product, key, value)
-    db.commit()
-    db.refresh(db_product)
+    await db.commit()
+    await db.refresh(db_product)
     await clear_cache()
+    await invalidate_product(product_id)
+    if price_changed:
+        await invalidate_all_cart_summaries()
+    trigram_index.add(product_id, db_product.name)
+    prefix_index.add(product_id, db_product.name)
     return db_product
 
 @router.delete("/{product_id}")
 async def delete_product(
     product_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="僅管理員可刪除產品")
-    db_product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
+    db_product = await db.get(ProductModel, product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="產品不存在")
-    db.delete(db_product)
-    db.commit()
+    await db.delete(db_product)
+    await db.commit()
     await clear_cache()
+    await invalidate_product(product_id)
+    await invalidate_all_cart_summaries()
+    trigram_index.remove(product_id)
+    prefix_index.remove(product_id)
     return {"message": "產品已刪除"}
\ No newline at end of file
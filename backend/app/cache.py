@@ -1,37 +1,263 @@
 import redis.asyncio as redis
+import asyncio
 import json
+import time
+from collections import OrderedDict
 from functools import wraps
-from typing import Callable, Any
+from typing import Callable, Any, Iterable, Optional
+from fastapi import Response
+from app.responses import JSONBytesResponse, conditional_response
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+# 建立用戶端不會連線，第一次指令時才由連線池建立連線；啟動檢查由 lifespan 執行
 redis_client = redis.Redis(
     host=os.getenv("REDIS_HOST", "localhost"),
     port=int(os.getenv("REDIS_PORT", 6379)),
     db=0
 )
 
-try:
-    redis_client.ping()
-except redis.ConnectionError:
-    print("Warning: Redis connection failed, caching disabled")
+async def check_redis_connection() -> None:
+    await redis_client.ping()
+
+async def close_redis() -> None:
+    """關閉 Redis 連線池，由應用程式 lifespan 在關閉時呼叫。"""
+    await redis_client.aclose()
+
+# 行程內 LRU 快取設定（每個 worker 各自一份，TTL 應短於 Redis TTL）
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 5))
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 1024))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+class LocalCache:
+    """以項目數與位元組數為上限的行程內 LRU 快取。"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: bytes, ttl: float) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, payload)
+        self.size += len(payload)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key: str) -> None:
+        _, payload = self._entries.pop(key)
+        self.size -= len(payload)
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES)
+
+def namespace_version_key(namespace: str) -> str:
+    return f"cache:ns:{namespace}"
+
+def remember_namespace_version(version_key: str, version: int, ttl: float = LOCAL_CACHE_TTL) -> None:
+    """更新行程內的命名空間版本；通知可能亂序抵達，只接受比目前更新的版本。"""
+    if ttl <= 0:
+        return
+    current = local_cache.get(version_key)
+    if current is not None and int(current) >= version:
+        return
+    local_cache.set(version_key, str(version).encode(), ttl)
+
+async def get_namespace_version(namespace: str) -> int:
+    """取得命名空間目前的版本號，行程內保留 LOCAL_CACHE_TTL 秒以省去 Redis 往返。"""
+    version_key = namespace_version_key(namespace)
+    cached = local_cache.get(version_key)
+    if cached is not None:
+        return int(cached)
+    try:
+        version = int(await redis_client.get(version_key) or 0)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, using default namespace version")
+        return 0
+    remember_namespace_version(version_key, version)
+    return version
+
+async def invalidate_namespace(namespace: str) -> None:
+    """以 INCR 遞增命名空間版本，使舊版本的快取鍵全部失效（O(1)），並通知其他 worker。
+
+    舊版本的項目不再被讀取，會隨 TTL 自然過期。
+    """
+    version_key = namespace_version_key(namespace)
+    try:
+        version = await redis_client.incr(version_key)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, namespace version not bumped")
+        local_cache.clear()
+        return
+    remember_namespace_version(version_key, version)
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, json.dumps({"namespace": namespace, "version": version}))
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, invalidation not broadcast")
+
+async def listen_for_invalidations() -> None:
+    """訂閱版本更新通知並更新行程內的命名空間版本，由應用程式 lifespan 啟動。"""
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # 重新連線期間可能漏接通知，保守地清空整個行程內快取
+                local_cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = json.loads(message["data"])
+                        remember_namespace_version(namespace_version_key(data["namespace"]), int(data["version"]))
+        except redis.RedisError as e:
+            print(f"Redis error: {e}, retrying invalidation subscription")
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+async def cache_get(key: str) -> Optional[bytes]:
+    try:
+        return await redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, cache lookup skipped")
+        return None
+
+async def cache_set(key: str, payload: bytes, timeout: int) -> None:
+    try:
+        await redis_client.setex(key, timeout, payload)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, skipping cache store")
+
+async def cache_get_many(keys: list[str]) -> list[Optional[bytes]]:
+    """以單一 MGET 讀取多個鍵，Redis 不可用時視為全部未命中。"""
+    try:
+        return await redis_client.mget(keys)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, cache lookup skipped")
+        return [None] * len(keys)
+
+async def cache_set_many(entries: dict[str, tuple[bytes, int]]) -> None:
+    """以 pipeline 一次寫入多個 ``鍵 -> (內容, TTL)``。"""
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, (payload, timeout) in entries.items():
+                pipe.setex(key, timeout, payload)
+            await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, skipping cache store")
+
+async def cache_delete(*keys: str) -> None:
+    try:
+        await redis_client.delete(*keys)
+    except redis.RedisError as e:
+        print(f"Redis error: {e}, cache not cleared")
+
+# 進行中的快取填充，同一個鍵的並發未命中共用同一次查詢
+_inflight: dict[str, asyncio.Task] = {}
+
+def make_cache_key(prefix: str, params: dict) -> str:
+    return f"{prefix}:{json.dumps(params, sort_keys=True, separators=(',', ':'))}"
+
+async def single_flight(key: str, fill: Callable[[], Any]) -> Any:
+    """同一時間對相同鍵只執行一次 fill，其餘呼叫端等待其結果。
+
+    fill 在獨立的 task 中執行並以 shield 等待，任一呼叫端被取消都不會中斷查詢或影響其他等待者。
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(fill())
+        _inflight[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            if _inflight.get(key) is finished:
+                del _inflight[key]
+            # 所有呼叫端都已取消時避免 "exception was never retrieved" 警告
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+def cache(
+    timeout=60,
+    key_params: Iterable[str] = (),
+    local_timeout: float = 0,
+    namespace: Optional[str] = None,
+    cache_control: Optional[str] = None,
+):
+    """快取端點回應。
+
+    快取鍵只由 ``key_params`` 列出的參數組成（避免把 ``db`` 等依賴注入物件放進鍵），
+    端點須回傳 Response 或已序列化的 JSON bytes，其內容直接存入 Redis，
+    命中時直接回傳 JSON 內容而不再經過 response_model 驗證。
+    ``local_timeout`` 大於 0 時，另於行程內 LRU 保留一份較短 TTL 的副本。
+    指定 ``namespace`` 時快取鍵包含命名空間版本，呼叫 ``invalidate_namespace`` 即可整批失效。
+    指定 ``cache_control`` 時（端點需宣告 ``request: Request``）回應附上 ETag 並處理 If-None-Match。
+    """
+    key_params = tuple(key_params)
+    local_ttl = min(local_timeout, timeout)
 
-def cache(timeout=60):
     def decorator(func: Callable) -> Callable:
+        prefix = f"{func.__module__}:{func.__name__}"
+
+        def serialize(result: Any) -> bytes:
+            # 端點需自行序列化（例如回傳 JSONBytesResponse），ORM 物件等無法以 json 正確序列化
+            if isinstance(result, Response):
+                return result.body
+            if isinstance(result, bytes):
+                return result
+            raise TypeError(
+                f"{prefix} must return a Response or JSON bytes to be cached, got {type(result).__name__}"
+            )
+
+        def respond(payload: bytes, request: Any) -> Response:
+            if cache_control is not None and request is not None:
+                return conditional_response(request, payload, cache_control)
+            return JSONBytesResponse(payload)
+
         @wraps(func)
         async def wrapper(*args, **kwargs: Any) -> Any:
-            cache_key = f"{func.__module__}:{func.__name__}:{json.dumps(kwargs, sort_keys=True)}"
-            try:
-                cached = await redis_client.get(cache_key)
-                if cached:
-                    return json.loads(cached)
-                result = await func(*args, **kwargs)
-                await redis_client.setex(cache_key, timeout, json.dumps(result))
-                return result
-            except redis.RedisError as e:
-                print(f"Redis error: {e}, falling back to function execution")
-                return await func(*args, **kwargs)
+            request = kwargs.get("request")
+            key_prefix = prefix
+            if namespace is not None:
+                key_prefix = f"{prefix}:v{await get_namespace_version(namespace)}"
+            cache_key = make_cache_key(key_prefix, {name: kwargs.get(name) for name in key_params})
+            if local_ttl > 0:
+                cached = local_cache.get(cache_key)
+                if cached is not None:
+                    return respond(cached, request)
+
+            async def fill() -> bytes:
+                payload = serialize(await func(*args, **kwargs))
+                await cache_set(cache_key, payload, timeout)
+                return payload
+
+            cached = await cache_get(cache_key)
+            if cached is None:
+                cached = await single_flight(cache_key, fill)
+            if local_ttl > 0:
+                local_cache.set(cache_key, cached, local_ttl)
+            return respond(cached, request)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
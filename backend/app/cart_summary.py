@@ -0,0 +1,48 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import cache_delete, cache_get, cache_set, get_namespace_version, invalidate_namespace, single_flight
+from app.models.cart import CartItem as CartItemModel
+from app.models.product import Product as ProductModel
+from app.schemas.cart import CartSummary
+from app.responses import JSONBytesResponse
+
+# 每位使用者的購物車摘要快取；產品價格變動時遞增命名空間版本使全部摘要失效
+CART_SUMMARY_NAMESPACE = "cart_summary"
+CART_SUMMARY_TIMEOUT = 300
+
+async def cart_summary_key(user_id: int) -> str:
+    version = await get_namespace_version(CART_SUMMARY_NAMESPACE)
+    return f"app.cart_summary:v{version}:{user_id}"
+
+async def compute_cart_summary(db: AsyncSession, user_id: int) -> CartSummary:
+    """以單一聚合查詢計算項目數、總數量與總價。"""
+    item_count, total_quantity, total_price = (await db.execute(
+        select(
+            func.count(CartItemModel.id),
+            func.coalesce(func.sum(CartItemModel.quantity), 0),
+            func.coalesce(func.sum(CartItemModel.quantity * ProductModel.price), 0),
+        )
+        .join(ProductModel, ProductModel.id == CartItemModel.product_id)
+        .where(CartItemModel.user_id == user_id)
+    )).one()
+    return CartSummary(item_count=item_count, total_quantity=total_quantity, total_price=total_price)
+
+async def get_cart_summary(db: AsyncSession, user_id: int) -> JSONBytesResponse:
+    key = await cart_summary_key(user_id)
+    cached = await cache_get(key)
+    if cached is None:
+        async def fill() -> bytes:
+            payload = (await compute_cart_summary(db, user_id)).model_dump_json().encode()
+            await cache_set(key, payload, CART_SUMMARY_TIMEOUT)
+            return payload
+
+        cached = await single_flight(key, fill)
+    return JSONBytesResponse(cached)
+
+async def invalidate_cart_summary(*user_ids: int):
+    """購物車寫入後清除對應使用者的摘要快取。"""
+    if user_ids:
+        await cache_delete(*[await cart_summary_key(user_id) for user_id in user_ids])
+
+async def invalidate_all_cart_summaries():
+    await invalidate_namespace(CART_SUMMARY_NAMESPACE)
@@ -1,25 +1,128 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./vuefastmart.db")
 
-try:
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-    engine.connect()
-except Exception as e:
-    raise Exception(f"Database connection failed: {e}")
+# 連線池設定（每個 worker 各自擁有一個連線池）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 將同步驅動的連線字串轉換為對應的 async 驅動
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme:
+        return url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+# 連線池統計
+pool_stats = {
+    "connects": 0,
+    "checkouts": 0,
+    "overflow_checkouts": 0,
+    "invalidations": 0,
+    "timeouts": 0,
+    "waits": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+}
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """記錄取得連線所花費時間與逾時次數的連線池。"""
+
+    def _do_get(self):
+        # 連線池已滿時呼叫端需要排隊等待
+        if self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow:
+            pool_stats["waits"] += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["wait_time_total"] += waited
+            pool_stats["wait_time_max"] = max(pool_stats["wait_time_max"], waited)
+
+def engine_options(url: str) -> dict:
+    """依資料庫方言產生 create_async_engine 參數。"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False}}
+        # 記憶體資料庫由 SQLAlchemy 使用 StaticPool，不接受連線池大小參數
+        if url.database and url.database != ":memory:":
+            options.update(
+                poolclass=InstrumentedQueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+        return options
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+
+AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats["connects"] += 1
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats["checkouts"] += 1
+    pool = engine.sync_engine.pool
+    if isinstance(pool, InstrumentedQueuePool) and pool.overflow() > 0:
+        pool_stats["overflow_checkouts"] += 1
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats["invalidations"] += 1
+
+def get_pool_metrics() -> dict:
+    pool = engine.sync_engine.pool
+    metrics = {"pool_class": type(pool).__name__, **pool_stats}
+    if isinstance(pool, InstrumentedQueuePool):
+        metrics.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checkedin=pool.checkedin(),
+            checkedout=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return metrics
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+async def check_database_connection():
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
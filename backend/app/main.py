@@ -1,10 +1,16 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from app.api import auth, products, cart
-from app.database import engine, Base
-from sqlalchemy import inspect
+from app.api import auth, products, cart, guest_cart
+from app.database import engine, Base, check_database_connection, get_pool_metrics
+from app.search import prefix_index, trigram_index
+from app.cache import listen_for_invalidations, check_redis_connection, close_redis
+from app.reservations import sweep_expired_reservations
+from app.middleware import CompressionMiddleware, SecurityHeadersMiddleware
 import os
+import redis.asyncio as redis
 
 load_dotenv()
 
@@ -12,7 +18,42 @@ load_dotenv()
 if not os.getenv("FRONTEND_URL"):
     raise ValueError("FRONTEND_URL environment variable is not set")
 
-app = FastAPI(title="VueFastMart API")
+# 啟動時是否自動建立表格（開發環境使用；正式環境以遷移管理結構，避免每個 worker 啟動時都檢查結構）
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "false").lower() in ("1", "true", "yes")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 匯入模組時不連線任何外部服務，所有啟動檢查集中於此
+    try:
+        await check_database_connection()
+    except Exception as e:
+        raise RuntimeError(f"Database connection failed: {str(e)}")
+    try:
+        await check_redis_connection()
+    except redis.RedisError:
+        print("Warning: Redis connection failed, caching disabled")
+    if DB_CREATE_ALL:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+    # 自動完成的前綴索引（SQLite 另有模糊搜尋的三元組索引）在背景建立與定期重建，不阻塞啟動
+    index_refreshers = [asyncio.create_task(prefix_index.refresh_periodically())]
+    if engine.dialect.name != "postgresql":
+        index_refreshers.append(asyncio.create_task(trigram_index.refresh_periodically()))
+    # 訂閱快取失效通知，清除本 worker 的行程內快取
+    invalidation_listener = asyncio.create_task(listen_for_invalidations())
+    # 定期歸還逾期的購物車庫存預留
+    reservation_sweeper = asyncio.create_task(sweep_expired_reservations())
+    yield
+    # 停止背景工作後依序關閉 Redis 連線池、密碼雜湊執行緒池與資料庫連線池
+    tasks = (reservation_sweeper, invalidation_listener, *index_refreshers)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await close_redis()
+    auth.shutdown_password_executor()
+    await engine.dispose()
+
+app = FastAPI(title="VueFastMart API", lifespan=lifespan)
 
 # 配置 CORS
 app.add_middleware(
@@ -23,33 +64,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 添加安全頭部
-@app.middleware("http")
-async def add_security_headers(request, call_next):
-    response = await call_next(request)
-    response.headers["Content-Security-Policy"] = (
+# 安全標頭與回應壓縮（純 ASGI，不經過 BaseHTTPMiddleware）
+SECURITY_HEADERS = {
+    "Content-Security-Policy": (
         "default-src 'self'; "
         "img-src 'self' https://via.placeholder.com; "
         "style-src 'self' 'unsafe-inline'; "
         "script-src 'self' 'unsafe-inline'"
-    )
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    return response
-
-# 檢查資料庫連線
-def check_database_connection():
-    try:
-        with engine.connect() as connection:
-            inspect(engine).get_table_names()
-    except Exception as e:
-        raise RuntimeError(f"Database connection failed: {str(e)}")
-
-check_database_connection()
-Base.metadata.create_all(bind=engine)
+    ),
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+}
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", 500)))
+app.add_middleware(SecurityHeadersMiddleware, headers=SECURITY_HEADERS)
 
 app.include_router(auth.router, prefix="/auth", tags=["認證"])
 app.include_router(products.router, prefix="/products", tags=["產品"])
+app.include_router(guest_cart.router, prefix="/cart/guest", tags=["購物車"])
 app.include_router(cart.router, prefix="/cart", tags=["購物車"])
 
 @app.get("/")
@@ -57,9 +88,19 @@ def read_root():
     return {"message": "歡迎使用 VueFastMart API"}
 
 @app.get("/health")
-def health_check():
+async def health_check():
+    """資料庫不可用時回報 unhealthy；Redis 僅影響快取，另外列出狀態。"""
+    try:
+        await check_redis_connection()
+        redis_status = "connected"
+    except redis.RedisError as e:
+        redis_status = str(e)
     try:
-        with engine.connect() as connection:
-            return {"status": "healthy", "database": "connected"}
+        await check_database_connection()
+        return {"status": "healthy", "database": "connected", "redis": redis_status}
     except Exception as e:
-        return {"status": "unhealthy", "database": str(e)}
\ No newline at end of file
+        return {"status": "unhealthy", "database": str(e), "redis": redis_status}
+
+@app.get("/metrics")
+def metrics():
+    return {"database_pool": get_pool_metrics()}
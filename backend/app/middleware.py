@@ -0,0 +1,163 @@
+from typing import Iterable, Optional
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，未安裝時只提供 gzip
+    brotli = None
+
+class SecurityHeadersMiddleware:
+    """純 ASGI 的安全標頭中介層，標頭於建立時預先編碼，每個回應只做一次串列合併。"""
+
+    def __init__(self, app, headers: dict[str, str]):
+        self.app = app
+        self.raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+        self.names = {name for name, _ in self.raw_headers}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = [header for header in message.get("headers", []) if header[0] not in self.names]
+                message["headers"] = headers + self.raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+def accepted_encoding(accept_encoding: str, available: Iterable[str]) -> Optional[str]:
+    """依 Accept-Encoding 挑選編碼（忽略 q=0），available 依偏好順序排列。"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    for coding in available:
+        if coding in accepted or "*" in accepted:
+            return coding
+    return None
+
+class CompressionMiddleware:
+    """純 ASGI 的 gzip/brotli 壓縮中介層。
+
+    只壓縮 content-type 在允許清單內、且內容至少 minimum_size 位元組的回應；
+    單一區塊的回應一次壓縮並重設 Content-Length，串流回應則逐塊壓縮。
+    壓縮後的表示法與原始內容不同，強 ETag 會轉為弱 ETag。
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 500,
+        content_types: Iterable[str] = ("application/json", "text/"),
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = accepted_encoding(accept_encoding, self.encodings) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self, encoding, send)(scope, receive)
+
+class CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive):
+        await self.middleware.app(scope, receive, self.send_compressed)
+
+    def compressible(self, headers: list[tuple[bytes, bytes]]) -> bool:
+        content_type = b""
+        for name, value in headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value
+        return content_type.decode("latin-1").startswith(self.middleware.content_types)
+
+    def compress(self, body: bytes) -> bytes:
+        if self.encoding == "br":
+            return brotli.compress(body, quality=self.middleware.brotli_quality)
+        return gzip.compress(body, compresslevel=self.middleware.gzip_level, mtime=0)
+
+    def start_stream(self):
+        if self.encoding == "br":
+            self.compressor = brotli.Compressor(quality=self.middleware.brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(self.middleware.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def stream_chunk(self, body: bytes, more_body: bool) -> bytes:
+        if self.encoding == "br":
+            chunk = self.compressor.process(body)
+            return chunk + (self.compressor.flush() if more_body else self.compressor.finish())
+        chunk = self.compressor.compress(body)
+        return chunk + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+    def encoded_headers(self, headers: list[tuple[bytes, bytes]], length: Optional[int]) -> list[tuple[bytes, bytes]]:
+        result = []
+        for name, value in headers:
+            if name == b"content-length":
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            result.append((name, value))
+        result.append((b"content-encoding", self.encoding.encode()))
+        result.append((b"vary", b"Accept-Encoding"))
+        if length is not None:
+            result.append((b"content-length", str(length).encode()))
+        return result
+
+    async def send_compressed(self, message):
+        if self.passthrough:
+            await self.send(message)
+            return
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = list(start.get("headers", []))
+            if not self.compressible(headers) or (not more_body and len(body) < self.middleware.minimum_size):
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            if not more_body:
+                body = self.compress(body)
+                await self.send({**start, "headers": self.encoded_headers(headers, len(body))})
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            self.start_stream()
+            await self.send({**start, "headers": self.encoded_headers(headers, None)})
+        await self.send({"type": "http.response.body", "body": self.stream_chunk(body, more_body), "more_body": more_body})
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, CheckConstraint, Index
+from sqlalchemy import Column, Integer, ForeignKey, CheckConstraint, Index, DateTime
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -9,6 +9,8 @@ class CartItem(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, default=1)
+    # 庫存預留到期時間（UTC），逾期由背景任務歸還庫存並移除項目
+    reserved_until = Column(DateTime, nullable=True)
 
     user = relationship("User")
     product = relationship("Product")
@@ -16,4 +18,5 @@ class CartItem(Base):
     __table_args__ = (
         CheckConstraint('quantity > 0', name='positive_quantity'),
         Index('idx_user_product', 'user_id', 'product_id', unique=True),
-    )
\ No newline at end of file
+        Index('idx_reserved_until', 'reserved_until'),
+    )
@@ -1,6 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, Text, Index, CheckConstraint
+from sqlalchemy import Column, Integer, String, Float, Text, Index, CheckConstraint, DDL, event, func, literal_column
 from app.database import Base
 
+def tsvector_expression(name, description):
+    """PostgreSQL 全文檢索使用的名稱與描述 tsvector 表達式。
+
+    查詢需使用完全相同的表達式才能命中 GIN 索引，因此常數以字面值而非綁定參數呈現。
+    """
+    return func.to_tsvector(
+        literal_column("'simple'::regconfig"),
+        func.coalesce(name, literal_column("''"))
+        + literal_column("' '")
+        + func.coalesce(description, literal_column("''")),
+    )
+
 class Product(Base):
     __tablename__ = "products"
 
@@ -13,6 +25,44 @@ class Product(Base):
 
     __table_args__ = (
         Index('idx_name', 'name'),
+        # 游標分頁以 (排序鍵, id) 進行索引搜尋
+        Index('idx_name_id', 'name', 'id'),
+        Index('idx_price_id', 'price', 'id'),
+        Index(
+            'idx_products_search', tsvector_expression(name, description), postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        # 模糊搜尋：pg_trgm 三元組 GIN 索引
+        Index(
+            'idx_products_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
         CheckConstraint('price > 0', name='positive_price'),
         CheckConstraint('stock >= 0', name='non_negative_stock'),
-    )
\ No newline at end of file
+    )
+
+search_vector = tsvector_expression(Product.name, Product.description)
+
+event.listen(
+    Product.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
+# SQLite 開發環境改用 FTS5 外部內容表，並以觸發器與 products 同步
+for statement in (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+):
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Product.__table__, "before_drop", DDL("DROP TABLE IF EXISTS products_fts").execute_if(dialect="sqlite"))
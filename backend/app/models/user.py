@@ -9,4 +9,6 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_admin = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # 遞增後使先前簽發的所有 token 失效
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
\ No newline at end of file
@@ -0,0 +1,54 @@
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+from typing import Any, Optional
+import base64
+import json
+
+# 游標中排序鍵值允許的型別；以 id 排序時只使用 last_id
+CURSOR_VALUE_TYPES = {
+    "price": (int, float),
+    "name": (str,),
+}
+
+def encode_cursor(sort: str, value: Any, last_id: int) -> str:
+    """將排序鍵與 id 編碼為不透明的游標字串。"""
+    raw = json.dumps([sort, value, last_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="游標格式錯誤")
+    if cursor_sort != sort or not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise HTTPException(status_code=400, detail="游標格式錯誤")
+    # 排序鍵值會直接作為查詢參數，型別不符時資料庫驅動會拋出錯誤
+    value_types = CURSOR_VALUE_TYPES.get(sort)
+    if value_types is not None and (not isinstance(value, value_types) or isinstance(value, bool)):
+        raise HTTPException(status_code=400, detail="游標格式錯誤")
+    return value, last_id
+
+def keyset_paginate(query: Select, sort_column, id_column, sort: str, after: Optional[str], limit: int) -> Select:
+    """依 (排序鍵, id) 排序並從游標之後開始取資料，每頁只需一次索引搜尋。
+
+    以 id 排序時只比較 id；其他排序鍵以 id 作為同值時的決勝欄位。
+    """
+    if sort_column is id_column:
+        query = query.order_by(id_column)
+        if after is not None:
+            _, last_id = decode_cursor(after, sort)
+            query = query.where(id_column > last_id)
+    else:
+        query = query.order_by(sort_column, id_column)
+        if after is not None:
+            value, last_id = decode_cursor(after, sort)
+            query = query.where(tuple_(sort_column, id_column) > tuple_(value, last_id))
+    return query.limit(limit)
+
+def next_cursor(items: list, sort: str, limit: int) -> Optional[str]:
+    """取滿一頁時，以最後一筆的排序鍵產生下一頁游標。"""
+    if len(items) < limit or not items:
+        return None
+    last = items[-1]
+    return encode_cursor(sort, getattr(last, sort), last.id)
@@ -0,0 +1,26 @@
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from app.models.product import Product as ProductModel
+
+# 列表端點只選取回應需要的欄位，不建立 ORM 物件
+PRODUCT_COLUMNS = (
+    ProductModel.id,
+    ProductModel.name,
+    ProductModel.description,
+    ProductModel.price,
+    ProductModel.stock,
+    ProductModel.image_url,
+)
+
+@dataclass(slots=True)
+class ProductRecord:
+    """產品列表的輕量資料列，欄位順序與 PRODUCT_COLUMNS 相同，可直接由 orjson 序列化。"""
+    id: int
+    name: str
+    description: Optional[str]
+    price: float
+    stock: int
+    image_url: Optional[str]
+
+def product_records(rows: Iterable) -> list[ProductRecord]:
+    return [ProductRecord(*row) for row in rows]
@@ -0,0 +1,95 @@
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import Counter
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Optional
+from app.database import AsyncSessionLocal
+from app.api.products import invalidate_product
+from app.cart_summary import invalidate_cart_summary
+from app.models.cart import CartItem as CartItemModel
+from app.models.product import Product as ProductModel
+import asyncio
+import os
+
+load_dotenv()
+
+# 購物車庫存預留時間，以及背景清理的間隔與每批處理筆數
+CART_RESERVATION_MINUTES = int(os.getenv("CART_RESERVATION_MINUTES", 60))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", 60))
+RESERVATION_SWEEP_BATCH_SIZE = int(os.getenv("RESERVATION_SWEEP_BATCH_SIZE", 500))
+
+def reservation_deadline() -> datetime:
+    """新增或調整購物車項目時重新計算的預留到期時間。"""
+    return datetime.utcnow() + timedelta(minutes=CART_RESERVATION_MINUTES)
+
+async def release_expired_reservations(
+    db: AsyncSession, now: Optional[datetime] = None, batch_size: int = RESERVATION_SWEEP_BATCH_SIZE
+) -> int:
+    """歸還逾期預留的庫存並移除對應的購物車項目，回傳處理筆數。
+
+    每批以 reserved_until 索引做範圍掃描取出最早到期的項目，依產品彙總數量後
+    以一次 executemany 歸還庫存、一次 IN 刪除項目，並各自提交。
+    與購物車端點相同，先依 id 鎖定產品再鎖定購物車項目，避免互相死結；
+    PostgreSQL 以 SKIP LOCKED 略過正被請求修改的產品與項目，多個 worker 同時清理也不會互相阻塞。
+    """
+    now = now or datetime.utcnow()
+    released = 0
+    while True:
+        candidates = (await db.execute(
+            select(CartItemModel.id, CartItemModel.product_id)
+            .where(CartItemModel.reserved_until < now)
+            .order_by(CartItemModel.reserved_until)
+            .limit(batch_size)
+        )).all()
+        if not candidates:
+            return released
+        locked_product_ids = (await db.scalars(
+            select(ProductModel.id)
+            .where(ProductModel.id.in_({row.product_id for row in candidates}))
+            .order_by(ProductModel.id)
+            .with_for_update(skip_locked=True)
+        )).all()
+        # 取得鎖之前項目可能已被移除或延長預留，重新檢查到期時間
+        rows = (await db.execute(
+            select(CartItemModel.id, CartItemModel.user_id, CartItemModel.product_id, CartItemModel.quantity)
+            .where(
+                CartItemModel.id.in_([row.id for row in candidates]),
+                CartItemModel.product_id.in_(locked_product_ids),
+                CartItemModel.reserved_until < now,
+            )
+            .order_by(CartItemModel.id)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if not rows:
+            await db.rollback()
+            return released
+        quantities = Counter()
+        for _, _, product_id, quantity in rows:
+            quantities[product_id] += quantity
+        products = ProductModel.__table__
+        await db.execute(
+            update(products)
+            .where(products.c.id == bindparam("product_id"))
+            .values(stock=products.c.stock + bindparam("quantity")),
+            [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()],
+        )
+        await db.execute(delete(CartItemModel).where(CartItemModel.id.in_([row.id for row in rows])))
+        await db.commit()
+        await invalidate_product(*quantities)
+        await invalidate_cart_summary(*{row.user_id for row in rows})
+        released += len(rows)
+        if len(candidates) < batch_size:
+            return released
+
+async def sweep_expired_reservations() -> None:
+    """定期清理逾期的庫存預留，由應用程式 lifespan 啟動。"""
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                released = await release_expired_reservations(db)
+            if released:
+                print(f"Released {released} expired cart reservations")
+        except Exception as e:
+            print(f"Reservation sweep failed: {e}")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
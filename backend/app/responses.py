@@ -0,0 +1,40 @@
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from typing import Any, Optional
+import hashlib
+import orjson
+
+class JSONBytesResponse(Response):
+    """以 orjson 序列化的 JSON 回應；內容已是 bytes 時直接送出（例如快取命中）。
+
+    dataclass（含 slots）與 datetime 由 orjson 原生處理，不經過 response_model 驗證。
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return orjson.dumps(content)
+
+def adapter_response(adapter: TypeAdapter, items: Any, from_attributes: bool = False) -> JSONBytesResponse:
+    """以模組層級的 TypeAdapter 在 Rust 端一次驗證並序列化整個列表。"""
+    return JSONBytesResponse(adapter.dump_json(adapter.validate_python(items, from_attributes=from_attributes)))
+
+def payload_etag(payload: bytes) -> str:
+    """由回應內容產生強 ETag；快取命中時內容已是 bytes，不需重新序列化。"""
+    return f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 採弱比較：忽略 W/ 前綴，支援逗號分隔的多個值與 *。"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+def conditional_response(request: Request, payload: bytes, cache_control: str) -> Response:
+    """附上 ETag 與 Cache-Control；客戶端持有相同版本時回傳不含內容的 304。"""
+    etag = payload_etag(payload)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONBytesResponse(payload, headers=headers)
@@ -1,19 +1,85 @@
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ConfigDict, TypeAdapter, field_validator
+from typing import Literal, Optional
+from datetime import datetime
 from .product import Product
 
 class CartItemCreate(BaseModel):
+    model_config = ConfigDict(strict=True)
+
     product_id: int
     quantity: int
 
-    @validator("quantity")
-    def quantity_positive(cls, v):
+    @field_validator("quantity")
+    @classmethod
+    def quantity_positive(cls, v: int) -> int:
+        if v <= 0:
+            raise ValueError("數量必須大於 0")
+        return v
+
+class CartItemUpdate(BaseModel):
+    model_config = ConfigDict(strict=True)
+
+    quantity: int
+
+    @field_validator("quantity")
+    @classmethod
+    def quantity_positive(cls, v: int) -> int:
         if v <= 0:
             raise ValueError("數量必須大於 0")
         return v
 
 class CartItem(CartItemCreate):
+    model_config = ConfigDict(from_attributes=True, strict=True)
+
+    id: int
+    product: Product
+    reserved_until: Optional[datetime] = None
+
+class CartOperation(BaseModel):
+    """批次操作中的單一項目：add 需 product_id，update/remove 需 cart_item_id。"""
+    model_config = ConfigDict(strict=True)
+
+    action: Literal["add", "update", "remove"]
+    product_id: Optional[int] = None
+    cart_item_id: Optional[int] = None
+    quantity: Optional[int] = None
+
+    @field_validator("quantity")
+    @classmethod
+    def quantity_positive(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and v <= 0:
+            raise ValueError("數量必須大於 0")
+        return v
+
+class CartBatchRequest(BaseModel):
+    operations: list[CartOperation]
+
+class CartOperationResult(BaseModel):
+    action: str
+    success: bool
+    detail: Optional[str] = None
+    item: Optional[CartItem] = None
+
+class GuestCartItem(BaseModel):
+    """訪客購物車項目，以產品 ID 作為項目 ID。"""
     id: int
+    product_id: int
+    quantity: int
     product: Product
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+class GuestCart(BaseModel):
+    cart_id: Optional[str] = None
+    items: list[GuestCartItem] = []
+
+class CartMergeResult(BaseModel):
+    items: list[CartItem]
+    skipped: list[int] = []
+
+class CartSummary(BaseModel):
+    item_count: int
+    total_quantity: int
+    total_price: float
+
+# get_cart 與批次端點直接由 ORM 物件驗證並序列化整個列表
+CartItemList = TypeAdapter(list[CartItem])
+CartOperationResultList = TypeAdapter(list[CartOperationResult])
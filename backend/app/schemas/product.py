@@ -1,21 +1,25 @@
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ConfigDict, TypeAdapter, field_validator
 from typing import Optional
 
 class ProductBase(BaseModel):
+    model_config = ConfigDict(strict=True)
+
     name: str
-    description: Optional[str]
+    description: Optional[str] = None
     price: float
     stock: int
-    image_url: Optional[str]
+    image_url: Optional[str] = None
 
-    @validator("price")
-    def price_positive(cls, v):
+    @field_validator("price")
+    @classmethod
+    def price_positive(cls, v: float) -> float:
         if v <= 0:
             raise ValueError("價格必須大於 0")
         return v
 
-    @validator("stock")
-    def stock_non_negative(cls, v):
+    @field_validator("stock")
+    @classmethod
+    def stock_non_negative(cls, v: int) -> int:
         if v < 0:
             raise ValueError("庫存不能為負")
         return v
@@ -24,7 +28,17 @@ class ProductCreate(ProductBase):
     pass
 
 class Product(ProductBase):
+    model_config = ConfigDict(from_attributes=True, strict=True)
+
+    id: int
+
+class ProductPage(BaseModel):
+    items: list[Product]
+    next_cursor: Optional[str] = None
+
+class ProductSuggestion(BaseModel):
     id: int
+    name: str
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+# 自動完成建議的回應轉接器（產品列表改走 records.py 的 orjson 路徑，不需要轉接器）
+ProductSuggestionList = TypeAdapter(list[ProductSuggestion])
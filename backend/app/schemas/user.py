@@ -1,13 +1,16 @@
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
 from datetime import datetime
 import re
 
 class UserCreate(BaseModel):
+    model_config = ConfigDict(strict=True)
+
     email: EmailStr
     password: str
 
-    @validator("password")
-    def validate_password(cls, v):
+    @field_validator("password")
+    @classmethod
+    def validate_password(cls, v: str) -> str:
         if len(v) < 8:
             raise ValueError("密碼需至少 8 個字符")
         if not re.search(r"[A-Za-z]", v) or not re.search(r"\d", v):
@@ -15,10 +18,9 @@ class UserCreate(BaseModel):
         return v
 
 class User(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     email: EmailStr
     is_admin: bool
     created_at: datetime
-
-    class Config:
-        orm_mode = True
\ No newline at end of file
@@ -0,0 +1,243 @@
+from sqlalchemy import Select, and_, case, column, func, literal_column, or_, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models.product import Product as ProductModel, search_vector
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+import asyncio
+import bisect
+import os
+import re
+
+# 模糊搜尋的相似度門檻（預設與 pg_trgm.similarity_threshold 相同，兩種資料庫皆適用）與行程內索引的重建間隔
+FUZZY_SIMILARITY_THRESHOLD = float(os.getenv("FUZZY_SIMILARITY_THRESHOLD", 0.3))
+FUZZY_INDEX_REFRESH = int(os.getenv("FUZZY_INDEX_REFRESH", 300))
+SUGGEST_INDEX_REFRESH = int(os.getenv("SUGGEST_INDEX_REFRESH", 300))
+
+# 中日韓文字（假名、CJK 統一表意文字、諺文）
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+# SQLite FTS5 外部內容表，由 models/product.py 的 DDL 建立
+products_fts = table("products_fts", column("rowid"))
+
+def search_terms(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+def contains_cjk(term: str) -> bool:
+    return CJK_PATTERN.search(term) is not None
+
+def substring_match(column_, term: str):
+    """欄位轉小寫後包含 term（search_terms 已轉小寫），LIKE 萬用字元自動跳脫。"""
+    return func.lower(column_).contains(term, autoescape=True)
+
+def full_text_search(query: Select, text: str, dialect: str) -> tuple[Select, object]:
+    """以全文檢索過濾產品名稱與描述，每個詞皆做前綴比對。
+
+    回傳加上過濾條件的查詢與排名表達式（數值越小越相關）。
+    PostgreSQL 使用 tsvector + GIN 索引，SQLite 使用 FTS5。
+    兩者的斷詞器都把連續的中日韓文字視為單一詞，只能比對開頭，
+    因此含中日韓文字的詞改以子字串比對，名稱符合者排在前面。
+    """
+    terms = search_terms(text)
+    cjk_terms = [term for term in terms if contains_cjk(term)]
+    terms = [term for term in terms if not contains_cjk(term)]
+    for term in cjk_terms:
+        query = query.where(or_(
+            substring_match(ProductModel.name, term), substring_match(ProductModel.description, term)
+        ))
+    if not terms:
+        name_matches = and_(*(substring_match(ProductModel.name, term) for term in cjk_terms))
+        return query, case((name_matches, 0), else_=1)
+    if dialect == "postgresql":
+        ts_query = func.to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{term}:*" for term in terms))
+        query = query.where(search_vector.op("@@")(ts_query))
+        return query, -func.ts_rank(search_vector, ts_query)
+    fts = literal_column("products_fts")
+    match = " AND ".join(f'"{term}"*' for term in terms)
+    query = query.join(products_fts, products_fts.c.rowid == ProductModel.id).where(fts.match(match))
+    return query, func.bm25(fts)
+
+async def apply_similarity_threshold(db: AsyncSession, threshold: float = FUZZY_SIMILARITY_THRESHOLD) -> None:
+    """將 FUZZY_SIMILARITY_THRESHOLD 套用到 pg_trgm 的 % 運算子，設定只在目前交易內有效。"""
+    await db.execute(select(func.set_config("pg_trgm.similarity_threshold", str(threshold), True)))
+
+def fuzzy_search(query: Select, text: str) -> Select:
+    """PostgreSQL 以 pg_trgm 的 % 運算子（可使用 GIN 索引）比對名稱，並依相似度排序。"""
+    return query.where(ProductModel.name.op("%")(text)).order_by(
+        func.similarity(ProductModel.name, text).desc(), ProductModel.id
+    )
+
+def trigrams(text: str) -> set[str]:
+    """依 pg_trgm 的規則切出三元組：每個詞轉小寫，前補兩個空白、後補一個空白。"""
+    grams = set()
+    for word in search_terms(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class NameIndex(ABC):
+    """以產品名稱建立的行程內索引基底類別，負責自 products 表載入與定期重建。
+
+    建立、更新、刪除產品的處理函式會即時呼叫 add/remove；定期重建由背景工作執行，
+    涵蓋其他 worker 的寫入，請求處理過程不會查詢資料庫。
+    """
+
+    def __init__(self, refresh_interval: int):
+        self.refresh_interval = refresh_interval
+        # 重建期間收到的即時更新（名稱為 None 代表刪除），新索引換上後依序重播
+        self._pending: Optional[list[tuple[int, Optional[str]]]] = None
+
+    @abstractmethod
+    def _build(self, rows: Iterable[tuple[int, str]]) -> tuple:
+        """由 (產品 id, 名稱) 建立全新的索引資料，不修改目前的索引。"""
+
+    @abstractmethod
+    def _swap(self, data: tuple) -> None:
+        """換上 _build 建立的索引資料。"""
+
+    @abstractmethod
+    def _add(self, product_id: int, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def _remove(self, product_id: int) -> None:
+        ...
+
+    def add(self, product_id: int, name: str) -> None:
+        self._add(product_id, name)
+        if self._pending is not None:
+            self._pending.append((product_id, name))
+
+    def remove(self, product_id: int) -> None:
+        self._remove(product_id)
+        if self._pending is not None:
+            self._pending.append((product_id, None))
+
+    def clear(self) -> None:
+        self._swap(self._build(()))
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        """自 products 表重建索引：在執行緒中建立新索引後一次換上，舊索引在此期間照常提供查詢。"""
+        self._pending = []
+        try:
+            rows = (await db.execute(select(ProductModel.id, ProductModel.name))).all()
+            data = await asyncio.to_thread(self._build, rows)
+            self._swap(data)
+            for product_id, name in self._pending:
+                if name is None:
+                    self._remove(product_id)
+                else:
+                    self._add(product_id, name)
+        finally:
+            self._pending = None
+
+    async def refresh_periodically(self) -> None:
+        """啟動後立即建立索引，之後每 refresh_interval 秒重建一次，由應用程式 lifespan 啟動。"""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.rebuild(db)
+            except Exception as e:
+                print(f"Name index rebuild failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+class TrigramIndex(NameIndex):
+    """SQLite 開發環境的行程內三元組倒排索引，提供與 pg_trgm 相同的相似度計算。"""
+
+    def __init__(self, refresh_interval: int = FUZZY_INDEX_REFRESH):
+        super().__init__(refresh_interval)
+        self._postings: dict[str, set[int]] = defaultdict(set)
+        self._grams: dict[int, set[str]] = {}
+
+    def _build(self, rows: Iterable[tuple[int, str]]) -> tuple:
+        postings: dict[str, set[int]] = defaultdict(set)
+        grams_by_id = {}
+        for product_id, name in rows:
+            grams = grams_by_id[product_id] = trigrams(name)
+            for gram in grams:
+                postings[gram].add(product_id)
+        return postings, grams_by_id
+
+    def _swap(self, data: tuple) -> None:
+        self._postings, self._grams = data
+
+    def _add(self, product_id: int, name: str) -> None:
+        self._remove(product_id)
+        grams = trigrams(name)
+        self._grams[product_id] = grams
+        for gram in grams:
+            self._postings[gram].add(product_id)
+
+    def _remove(self, product_id: int) -> None:
+        for gram in self._grams.pop(product_id, ()):
+            self._postings[gram].discard(product_id)
+
+    def search(self, text: str, threshold: float = FUZZY_SIMILARITY_THRESHOLD) -> list[tuple[int, float]]:
+        """回傳 (產品 id, 相似度)，只走訪與查詢共用三元組的候選項目。"""
+        query_grams = trigrams(text)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._postings.get(gram, ()))
+        results = []
+        for product_id, count in shared.items():
+            similarity = count / (len(query_grams) + len(self._grams[product_id]) - count)
+            if similarity >= threshold:
+                results.append((product_id, similarity))
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results
+
+class PrefixIndex(NameIndex):
+    """自動完成用的排序陣列前綴索引：名稱中每個詞的起點各佔一筆，以 bisect 搜尋。"""
+
+    def __init__(self, refresh_interval: int = SUGGEST_INDEX_REFRESH):
+        super().__init__(refresh_interval)
+        self._keys: list[tuple[str, int]] = []
+        self._names: dict[int, str] = {}
+
+    @staticmethod
+    def _entries(product_id: int, name: str) -> set[tuple[str, int]]:
+        lowered = name.lower()
+        return {(lowered[match.start():], product_id) for match in re.finditer(r"\w+", lowered)}
+
+    def _build(self, rows: Iterable[tuple[int, str]]) -> tuple:
+        # 全部項目排序一次（O(n log n)），而不是逐筆 insort
+        names = dict(rows)
+        keys = sorted(entry for product_id, name in names.items() for entry in self._entries(product_id, name))
+        return keys, names
+
+    def _swap(self, data: tuple) -> None:
+        self._keys, self._names = data
+
+    def _add(self, product_id: int, name: str) -> None:
+        self._remove(product_id)
+        self._names[product_id] = name
+        for entry in self._entries(product_id, name):
+            bisect.insort(self._keys, entry)
+
+    def _remove(self, product_id: int) -> None:
+        name = self._names.pop(product_id, None)
+        if name is None:
+            return
+        for entry in self._entries(product_id, name):
+            index = bisect.bisect_left(self._keys, entry)
+            if index < len(self._keys) and self._keys[index] == entry:
+                del self._keys[index]
+
+    def search(self, prefix: str, limit: int) -> list[tuple[int, str]]:
+        """回傳名稱中有詞以 prefix 開頭的 (產品 id, 名稱)，最多 limit 筆。"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        results = {}
+        index = bisect.bisect_left(self._keys, (prefix,))
+        while index < len(self._keys) and len(results) < limit:
+            key, product_id = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            results.setdefault(product_id, self._names[product_id])
+            index += 1
+        return list(results.items())
+
+trigram_index = TrigramIndex()
+prefix_index = PrefixIndex()
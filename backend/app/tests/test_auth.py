@@ -2,36 +2,56 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
 from app.database import Base, get_db
 from app.models.user import User
+from app.api import auth
+from app.api.auth import _user_cache
 from passlib.context import CryptContext
+from sqlalchemy import event
+from jose import jwt
+from unittest.mock import patch
+import os
+import tempfile
 
-DATABASE_URL = "sqlite:///:memory:"
+# 同步引擎供測試資料準備使用，應用程式則透過 async 引擎存取同一個資料庫檔案
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), "vuefastmart_test_auth.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 engine = create_engine(DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app.dependency_overrides[get_db] = override_get_db
 client = TestClient(app)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="function")
 def setup_database():
+    app.dependency_overrides[get_db] = override_get_db
+    _user_cache.clear()
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
 
+def login(email="test@example.com", password="securepassword"):
+    """建立管理員帳號並登入，回傳 access token。"""
+    db = TestingSessionLocal()
+    db.add(User(email=email, hashed_password=pwd_context.hash(password), is_admin=True))
+    db.commit()
+    db.close()
+    response = client.post("/auth/token", data={"username": email, "password": password})
+    return response.json()["access_token"]
+
 def test_register_user(setup_database):
     response = client.post(
         "/auth/register",
-        json={"email": "test@example.com", "password": "securepassword"}
+        json={"email": "test@example.com", "password": "securepassword1"}
     )
     assert response.status_code == 200
     data = response.json()
@@ -41,11 +61,11 @@ def test_register_user(setup_database):
 def test_register_duplicate_email(setup_database):
     client.post(
         "/auth/register",
-        json={"email": "test@example.com", "password": "securepassword"}
+        json={"email": "test@example.com", "password": "securepassword1"}
     )
     response = client.post(
         "/auth/register",
-        json={"email": "test@example.com", "password": "anotherpassword"}
+        json={"email": "test@example.com", "password": "anotherpassword1"}
     )
     assert response.status_code == 400
     assert response.json()["detail"] == "電子郵件已被註冊"
@@ -74,4 +94,55 @@ def test_login_invalid_credentials(setup_database):
         data={"username": "test@example.com", "password": "wrongpassword"}
     )
     assert response.status_code == 401
-    assert response.json()["detail"] == "電子郵件或密碼錯誤"
\ No newline at end of file
+    assert response.json()["detail"] == "電子郵件或密碼錯誤"
+
+def test_token_carries_user_id_and_skips_user_query(setup_database):
+    token = login()
+    payload = jwt.get_unverified_claims(token)
+    assert payload["uid"] == 1 and payload["ver"] == 0
+    assert "adm" not in payload
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/auth/users/me", headers={"Authorization": f"Bearer {token}"})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert response.json()["email"] == "test@example.com"
+    assert response.json()["is_admin"] is True
+    assert statements == []
+
+def test_logout_all_revokes_existing_tokens(setup_database):
+    token = login()
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post("/auth/logout-all", headers=headers)
+    assert response.status_code == 200
+    response = client.get("/auth/users/me", headers=headers)
+    assert response.status_code == 401
+
+    new_token = client.post(
+        "/auth/token", data={"username": "test@example.com", "password": "securepassword"}
+    ).json()["access_token"]
+    assert jwt.get_unverified_claims(new_token)["ver"] == 1
+    assert client.get("/auth/users/me", headers={"Authorization": f"Bearer {new_token}"}).status_code == 200
+
+def test_register_returns_429_when_password_pool_saturated(setup_database):
+    with patch.object(auth, "PASSWORD_HASH_MAX_PENDING", 0):
+        response = client.post(
+            "/auth/register",
+            json={"email": "test@example.com", "password": "securepassword1"}
+        )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+def test_login_rehashes_password_with_configured_rounds(setup_database):
+    login()
+    with patch.object(auth, "get_pwd_context", lambda: CryptContext(schemes=["bcrypt"], bcrypt__rounds=5)):
+        response = client.post("/auth/token", data={"username": "test@example.com", "password": "securepassword"})
+    assert response.status_code == 200
+    db = TestingSessionLocal()
+    assert db.query(User).one().hashed_password.split("$")[2] == "05"
+    db.close()
@@ -2,35 +2,44 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
 from app.database import Base, get_db
 from app.models.user import User
 from app.models.product import Product
 from app.models.cart import CartItem
+from app.reservations import release_expired_reservations
+from app.cache import local_cache
 from passlib.context import CryptContext
 from jose import jwt
 from datetime import datetime, timedelta
+import json
 import os
+import tempfile
+from unittest.mock import AsyncMock, call, patch
 
-DATABASE_URL = "sqlite:///:memory:"
+# 同步引擎供測試資料準備使用，應用程式則透過 async 引擎存取同一個資料庫檔案
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), "vuefastmart_test_cart.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 engine = create_engine(DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 SECRET_KEY = os.getenv("SECRET_KEY", "your-very-secure-secret-key")
 ALGORITHM = "HS256"
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app.dependency_overrides[get_db] = override_get_db
 client = TestClient(app)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="function")
 def setup_database():
+    app.dependency_overrides[get_db] = override_get_db
+    local_cache.clear()
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
@@ -121,4 +130,199 @@ def test_remove_nonexistent_cart_item(setup_database, test_user):
         headers={"Authorization": f"Bearer {test_user['token']}"}
     )
     assert response.status_code == 404
-    assert response.json()["detail"] == "購物車項目不存在"
\ No newline at end of file
+    assert response.json()["detail"] == "購物車項目不存在"
+@patch("app.cache.redis_client")
+def test_add_to_cart_invalidates_product_cache(mock_redis, setup_database, test_user, test_product):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.delete = AsyncMock()
+    response = client.post(
+        "/cart/",
+        json={"product_id": test_product.id, "quantity": 1},
+        headers={"Authorization": f"Bearer {test_user['token']}"}
+    )
+    assert response.status_code == 200
+    assert mock_redis.delete.call_args_list == [
+        call(f"app.api.products:product:{test_product.id}"),
+        call(f"app.cart_summary:v0:{test_user['user'].id}"),
+    ]
+
+def test_add_to_cart_reserves_stock_atomically(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    response = client.post("/cart/", json={"product_id": test_product.id, "quantity": 4}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["product"]["stock"] == 6
+    response = client.post("/cart/", json={"product_id": test_product.id, "quantity": 7}, headers=headers)
+    assert response.status_code == 400
+    db = TestingSessionLocal()
+    assert db.get(Product, test_product.id).stock == 6
+    db.close()
+
+def test_add_to_cart_nonexistent_product(setup_database, test_user):
+    response = client.post(
+        "/cart/",
+        json={"product_id": 999, "quantity": 1},
+        headers={"Authorization": f"Bearer {test_user['token']}"}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "產品不存在"
+
+def test_add_to_cart_twice_accumulates_quantity(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    first = client.post("/cart/", json={"product_id": test_product.id, "quantity": 2}, headers=headers)
+    second = client.post("/cart/", json={"product_id": test_product.id, "quantity": 3}, headers=headers)
+    assert second.status_code == 200
+    assert second.json()["id"] == first.json()["id"]
+    assert second.json()["quantity"] == 5
+    assert second.json()["product"]["stock"] == 5
+    data = client.get("/cart/", headers=headers).json()
+    assert len(data) == 1 and data[0]["quantity"] == 5
+
+def test_update_cart_item_adjusts_stock_by_delta(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    cart_item_id = client.post(
+        "/cart/", json={"product_id": test_product.id, "quantity": 2}, headers=headers
+    ).json()["id"]
+    response = client.put(
+        f"/cart/{cart_item_id}", json={"product_id": test_product.id, "quantity": 5}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 5
+    assert response.json()["product"]["stock"] == 5
+    response = client.put(f"/cart/{cart_item_id}", json={"quantity": 1}, headers=headers)
+    assert response.json()["product"]["stock"] == 9
+    response = client.put(f"/cart/{cart_item_id}", json={"quantity": 11}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "庫存不足"
+    data = client.get("/cart/", headers=headers).json()
+    assert data[0]["quantity"] == 1 and data[0]["product"]["stock"] == 9
+
+def test_update_nonexistent_cart_item(setup_database, test_user):
+    response = client.put(
+        "/cart/999",
+        json={"quantity": 1},
+        headers={"Authorization": f"Bearer {test_user['token']}"}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "購物車項目不存在"
+
+def test_batch_update_cart(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    db = TestingSessionLocal()
+    other = Product(name="其他產品", description="另一個測試產品", price=50.0, stock=3)
+    db.add(other)
+    db.commit()
+    other_id = other.id
+    db.close()
+    cart_item_id = client.post(
+        "/cart/", json={"product_id": test_product.id, "quantity": 2}, headers=headers
+    ).json()["id"]
+
+    response = client.post("/cart/batch", json={"operations": [
+        {"action": "update", "cart_item_id": cart_item_id, "quantity": 4},
+        {"action": "add", "product_id": other_id, "quantity": 5},
+        {"action": "add", "product_id": other_id, "quantity": 3},
+        {"action": "add", "product_id": 999, "quantity": 1},
+        {"action": "remove", "cart_item_id": 999},
+    ]}, headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["success"] for result in results] == [True, False, True, False, False]
+    assert results[1]["detail"] == "庫存不足"
+    assert results[3]["detail"] == "產品不存在"
+    assert results[4]["detail"] == "購物車項目不存在"
+    assert results[0]["item"]["quantity"] == 4
+    assert results[0]["item"]["product"]["stock"] == 6
+    assert results[2]["item"]["quantity"] == 3
+    assert results[2]["item"]["product"]["stock"] == 0
+
+    data = {item["product_id"]: item for item in client.get("/cart/", headers=headers).json()}
+    assert data[test_product.id]["quantity"] == 4
+    assert data[other_id]["quantity"] == 3
+
+def test_batch_remove_and_re_add_same_product(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    cart_item_id = client.post(
+        "/cart/", json={"product_id": test_product.id, "quantity": 2}, headers=headers
+    ).json()["id"]
+    response = client.post("/cart/batch", json={"operations": [
+        {"action": "remove", "cart_item_id": cart_item_id},
+        {"action": "update", "cart_item_id": cart_item_id, "quantity": 1},
+        {"action": "add", "product_id": test_product.id, "quantity": 7},
+    ]}, headers=headers)
+    results = response.json()
+    assert [result["success"] for result in results] == [True, False, True]
+    assert results[0]["item"] is None
+    assert results[2]["item"]["quantity"] == 7
+    assert results[2]["item"]["product"]["stock"] == 3
+    data = client.get("/cart/", headers=headers).json()
+    assert len(data) == 1 and data[0]["quantity"] == 7
+
+def test_add_to_cart_sets_reservation_expiry(setup_database, test_user, test_product):
+    response = client.post(
+        "/cart/",
+        json={"product_id": test_product.id, "quantity": 1},
+        headers={"Authorization": f"Bearer {test_user['token']}"}
+    )
+    reserved_until = datetime.fromisoformat(response.json()["reserved_until"])
+    assert reserved_until > datetime.utcnow() + timedelta(minutes=1)
+
+@pytest.mark.asyncio
+async def test_release_expired_reservations(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    db = TestingSessionLocal()
+    other = Product(name="其他產品", description="另一個測試產品", price=50.0, stock=5)
+    db.add(other)
+    db.commit()
+    db.add_all([
+        CartItem(user_id=test_user["user"].id, product_id=test_product.id, quantity=3,
+                 reserved_until=datetime.utcnow() - timedelta(minutes=5)),
+        CartItem(user_id=test_user["user"].id, product_id=other.id, quantity=2,
+                 reserved_until=datetime.utcnow() + timedelta(minutes=5)),
+    ])
+    db.commit()
+    db.close()
+
+    async with TestingAsyncSessionLocal() as async_db:
+        assert await release_expired_reservations(async_db, batch_size=1) == 1
+        assert await release_expired_reservations(async_db) == 0
+
+    data = client.get("/cart/", headers=headers).json()
+    assert [item["product"]["name"] for item in data] == ["其他產品"]
+    db = TestingSessionLocal()
+    assert db.get(Product, test_product.id).stock == 13
+    db.close()
+
+@patch("app.cache.redis_client")
+def test_cart_summary_aggregates_and_is_cached(mock_redis, setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    mock_redis.delete = AsyncMock()
+    response = client.get("/cart/summary", headers=headers)
+    assert response.json() == {"item_count": 0, "total_quantity": 0, "total_price": 0.0}
+
+    db = TestingSessionLocal()
+    other = Product(name="其他產品", description="另一個測試產品", price=25.5, stock=5)
+    db.add(other)
+    db.commit()
+    other_id = other.id
+    db.close()
+    client.post("/cart/", json={"product_id": test_product.id, "quantity": 2}, headers=headers)
+    client.post("/cart/", json={"product_id": other_id, "quantity": 2}, headers=headers)
+    response = client.get("/cart/summary", headers=headers)
+    assert response.json() == {"item_count": 2, "total_quantity": 4, "total_price": 251.0}
+    key, timeout, payload = mock_redis.setex.call_args.args
+    assert key == f"app.cart_summary:v0:{test_user['user'].id}"
+    assert json.loads(payload)["total_price"] == 251.0
+
+    # 快取命中時不再查詢資料庫
+    mock_redis.get = AsyncMock(return_value=b'{"item_count":9,"total_quantity":9,"total_price":9.0}')
+    assert client.get("/cart/summary", headers=headers).json()["item_count"] == 9
+
+def test_add_to_cart_rejects_non_integer_quantity(setup_database, test_user, test_product):
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    response = client.post("/cart/", json={"product_id": test_product.id, "quantity": "2"}, headers=headers)
+    assert response.status_code == 422
+    response = client.post("/cart/", json={"product_id": test_product.id, "quantity": 0}, headers=headers)
+    assert response.status_code == 422
+    assert "數量必須大於 0" in response.text
@@ -0,0 +1,200 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from app.main import app
+from app.database import Base, get_db
+from app.models.user import User
+from app.models.product import Product
+from jose import jwt
+from datetime import datetime, timedelta
+import os
+import tempfile
+from unittest.mock import patch
+
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), "vuefastmart_test_guest_cart.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+engine = create_engine(DATABASE_URL)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+SECRET_KEY = os.getenv("SECRET_KEY", "your-very-secure-secret-key")
+ALGORITHM = "HS256"
+
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+client = TestClient(app)
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args) for name, args in self.commands]
+
+class FakeRedis:
+    """測試用的記憶體 Redis，只實作購物車與產品快取用到的指令。"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def setex(self, key, timeout, payload):
+        self.data[key] = payload
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def expire(self, key, timeout):
+        self.ttl[key] = timeout
+
+    async def hget(self, key, field):
+        value = self.data.get(key, {}).get(str(field))
+        return None if value is None else str(value).encode()
+
+    async def hset(self, key, field, value):
+        self.data.setdefault(key, {})[str(field)] = int(value)
+
+    async def hincrby(self, key, field, amount):
+        entries = self.data.setdefault(key, {})
+        entries[str(field)] = entries.get(str(field), 0) + amount
+        return entries[str(field)]
+
+    async def hdel(self, key, field):
+        return int(self.data.get(key, {}).pop(str(field), None) is not None)
+
+    async def hgetall(self, key):
+        return {field.encode(): str(value).encode() for field, value in self.data.get(key, {}).items()}
+
+@pytest.fixture(scope="function")
+def setup_database():
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def fake_redis():
+    fake = FakeRedis()
+    with patch("app.cache.redis_client", fake):
+        yield fake
+
+@pytest.fixture
+def test_user():
+    db = TestingSessionLocal()
+    user = User(email="guest@example.com", hashed_password="unused")
+    db.add(user)
+    db.commit()
+    db.close()
+    token = jwt.encode(
+        {"sub": "guest@example.com", "exp": datetime.utcnow() + timedelta(minutes=30)},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def test_products():
+    db = TestingSessionLocal()
+    products = [
+        Product(name="訪客產品一", description="描述", price=100.0, stock=10),
+        Product(name="訪客產品二", description="描述", price=50.0, stock=2),
+    ]
+    db.add_all(products)
+    db.commit()
+    ids = [product.id for product in products]
+    db.close()
+    return ids
+
+def test_guest_cart_does_not_write_database(setup_database, fake_redis, test_products):
+    response = client.post("/cart/guest/", json={"product_id": test_products[0], "quantity": 2})
+    assert response.status_code == 200
+    cart_id = response.json()["cart_id"]
+    headers = {"X-Guest-Cart-Id": cart_id}
+    response = client.post("/cart/guest/", json={"product_id": test_products[0], "quantity": 3}, headers=headers)
+    client.post("/cart/guest/", json={"product_id": test_products[1], "quantity": 1}, headers=headers)
+    response = client.put(f"/cart/guest/{test_products[1]}", json={"quantity": 2}, headers=headers)
+    items = {item["product_id"]: item for item in response.json()["items"]}
+    assert items[test_products[0]]["quantity"] == 5
+    assert items[test_products[1]]["quantity"] == 2
+    assert items[test_products[0]]["product"]["name"] == "訪客產品一"
+    assert fake_redis.ttl[f"cart:guest:{cart_id}"] > 0
+
+    response = client.delete(f"/cart/guest/{test_products[1]}", headers=headers)
+    assert [item["product_id"] for item in response.json()["items"]] == [test_products[0]]
+
+    # 訪客購物車不預留庫存
+    db = TestingSessionLocal()
+    assert db.get(Product, test_products[0]).stock == 10
+    db.close()
+
+def test_guest_cart_validates_stock(setup_database, fake_redis, test_products):
+    response = client.post("/cart/guest/", json={"product_id": test_products[1], "quantity": 3})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "庫存不足"
+    response = client.post("/cart/guest/", json={"product_id": 999, "quantity": 1})
+    assert response.status_code == 404
+    response = client.get("/cart/guest/", headers={"X-Guest-Cart-Id": "bad id"})
+    assert response.status_code == 400
+
+def test_merge_guest_cart_on_login(setup_database, fake_redis, test_user, test_products):
+    cart_id = client.post("/cart/guest/", json={"product_id": test_products[0], "quantity": 2}).json()["cart_id"]
+    headers = {"X-Guest-Cart-Id": cart_id}
+    client.post("/cart/guest/", json={"product_id": test_products[1], "quantity": 2}, headers=headers)
+    # 併入前庫存被其他人買走
+    db = TestingSessionLocal()
+    db.get(Product, test_products[1]).stock = 1
+    db.commit()
+    db.close()
+    client.post("/cart/", json={"product_id": test_products[0], "quantity": 1}, headers=test_user)
+
+    response = client.post("/cart/guest/merge", headers={**headers, **test_user})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["skipped"] == [test_products[1]]
+    assert len(data["items"]) == 1
+    assert data["items"][0]["quantity"] == 3
+    assert data["items"][0]["product"]["stock"] == 7
+    assert f"cart:guest:{cart_id}" not in fake_redis.data
+
+def test_merge_guest_cart_only_once(setup_database, fake_redis, test_user, test_products):
+    cart_id = client.post("/cart/guest/", json={"product_id": test_products[0], "quantity": 2}).json()["cart_id"]
+    headers = {"X-Guest-Cart-Id": cart_id, **test_user}
+    assert client.post("/cart/guest/merge", headers=headers).status_code == 200
+    # 重複送出的合併請求取不到已被取走的購物車，不會再次預留庫存
+    data = client.post("/cart/guest/merge", headers=headers).json()
+    assert data["items"][0]["quantity"] == 2
+    assert data["items"][0]["product"]["stock"] == 8
+
+def test_merge_guest_cart_restored_on_failure(setup_database, fake_redis, test_user, test_products):
+    cart_id = client.post("/cart/guest/", json={"product_id": test_products[0], "quantity": 2}).json()["cart_id"]
+    with patch("app.api.guest_cart.upsert_cart_item", side_effect=RuntimeError("db down")):
+        with pytest.raises(RuntimeError):
+            client.post("/cart/guest/merge", headers={"X-Guest-Cart-Id": cart_id, **test_user})
+    assert fake_redis.data[f"cart:guest:{cart_id}"] == {str(test_products[0]): 2}
+    db = TestingSessionLocal()
+    assert db.get(Product, test_products[0]).stock == 10
+    db.close()
@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from app.main import SECURITY_HEADERS
+from app.middleware import CompressionMiddleware, SecurityHeadersMiddleware, accepted_encoding
+from app.responses import JSONBytesResponse
+import gzip
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+app.add_middleware(SecurityHeadersMiddleware, headers=SECURITY_HEADERS)
+LARGE_PAYLOAD = b"[" + b",".join(b'{"id":%d,"name":"product"}' % i for i in range(50)) + b"]"
+
+@app.get("/large")
+def large():
+    return JSONBytesResponse(LARGE_PAYLOAD, headers={"ETag": '"abc"', "X-Frame-Options": "SAMEORIGIN"})
+
+@app.get("/small")
+def small():
+    return JSONBytesResponse(b"[]")
+
+@app.get("/text")
+def text():
+    return PlainTextResponse("x" * 1000, media_type="image/svg+xml")
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse((b'{"chunk":%d}\n' % i for i in range(100)), media_type="text/plain")
+
+client = TestClient(app)
+
+def test_security_headers_override_response_headers():
+    response = client.get("/small")
+    assert response.headers["X-Frame-Options"] == "DENY"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert response.headers["Content-Security-Policy"].startswith("default-src 'self'")
+    response = client.get("/large")
+    assert response.headers.get_list("X-Frame-Options") == ["DENY"]
+
+def test_compresses_large_allowed_responses():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["ETag"] == 'W/"abc"'
+    assert int(response.headers["Content-Length"]) < len(LARGE_PAYLOAD)
+    assert response.content == LARGE_PAYLOAD
+
+def test_skips_small_disallowed_or_unrequested_responses():
+    assert "Content-Encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in client.get("/text", headers={"Accept-Encoding": "gzip"}).headers
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == '"abc"'
+    assert "Content-Encoding" not in client.get("/large", headers={"Accept-Encoding": "gzip;q=0"}).headers
+
+def test_compresses_streaming_responses():
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw) == b"".join(b'{"chunk":%d}\n' % i for i in range(100))
+
+def test_accepted_encoding_prefers_available_order():
+    assert accepted_encoding("gzip, br", ("br", "gzip")) == "br"
+    assert accepted_encoding("gzip, br;q=0", ("br", "gzip")) == "gzip"
+    assert accepted_encoding("*", ("gzip",)) == "gzip"
+    assert accepted_encoding("deflate", ("gzip",)) is None
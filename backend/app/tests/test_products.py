@@ -1,40 +1,53 @@
 import pytest
+import asyncio
 import json
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
 from app.database import Base, get_db
+from app.cache import cache, local_cache, LocalCache, single_flight, remember_namespace_version
+from app.responses import JSONBytesResponse
+from app.pagination import encode_cursor
+from app.search import trigram_index, prefix_index, TrigramIndex, PrefixIndex, apply_similarity_threshold
 from app.models.product import Product
 from app.models.user import User
 from jose import jwt
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 import os
+import tempfile
 import redis.asyncio as redis
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
-DATABASE_URL = "sqlite:///:memory:"
+# 同步引擎供測試資料準備使用，應用程式則透過 async 引擎存取同一個資料庫檔案
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), "vuefastmart_test_products.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 engine = create_engine(DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable is not set")
 ALGORITHM = "HS256"
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app.dependency_overrides[get_db] = override_get_db
 client = TestClient(app)
 
 @pytest.fixture(scope="function")
 def setup_database():
+    app.dependency_overrides[get_db] = override_get_db
+    local_cache.clear()
+    trigram_index.clear()
+    prefix_index.clear()
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
@@ -220,10 +233,11 @@ def test_delete_product(setup_database, admin_user):
     assert response.status_code == 200
     assert response.json()["message"] == "產品已刪除"
 
-@patch("app.api.products.redis_client")
-async def test_delete_product_clears_cache(setup_database, admin_user, mock_redis):
-    mock_redis.keys = AsyncMock(return_value=[b"app.api.products:get_products:0:10"])
-    mock_redis.delete = AsyncMock()
+@patch("app.cache.redis_client")
+def test_delete_product_clears_cache(mock_redis, setup_database, admin_user):
+    mock_redis.incr = AsyncMock(side_effect=[1, 2, 1])
+    mock_redis.publish = AsyncMock()
+    mock_redis.keys = AsyncMock()
     response = client.post(
         "/products/",
         json={"name": "測試產品", "description": "這是一個測試產品", "price": 100.0, "stock": 10},
@@ -236,5 +250,420 @@ async def test_delete_product_clears_cache(setup_database, admin_user, mock_redi
         headers={"Authorization": f"Bearer {admin_user['token']}"}
     )
     assert response.status_code == 200
-    mock_redis.keys.assert_called_once_with("app.api.products:get_products:*")
-    mock_redis.delete.assert_called_once()
\ No newline at end of file
+    # 產品列表與購物車摘要各自遞增命名空間版本
+    assert mock_redis.incr.call_args_list == [
+        call("cache:ns:products"), call("cache:ns:products"), call("cache:ns:cart_summary")
+    ]
+    mock_redis.publish.assert_any_call("cache:invalidate", json.dumps({"namespace": "products", "version": 2}))
+    mock_redis.keys.assert_not_called()
+
+@patch("app.cache.redis_client")
+def test_get_products_cache_key_excludes_db(mock_redis, setup_database, test_products):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    response = client.get("/products/?skip=0&limit=2")
+    assert response.status_code == 200
+    key, timeout, payload = mock_redis.setex.call_args.args
+    assert key == 'app.api.products:get_products:v0:{"after":null,"limit":2,"paginate":"offset","skip":0,"sort":"id"}'
+    assert timeout == 60
+    assert json.loads(payload) == response.json()
+
+@patch("app.cache.redis_client")
+def test_get_products_cache_hit(mock_redis, setup_database):
+    cached = [{"id": 1, "name": "快取產品", "description": None, "price": 10.0, "stock": 1, "image_url": None}]
+    mock_redis.get = AsyncMock(side_effect=[b"3", json.dumps(cached).encode()])
+    mock_redis.setex = AsyncMock()
+    response = client.get("/products/?skip=0&limit=10")
+    mock_redis.get.assert_called_with(
+        'app.api.products:get_products:v3:{"after":null,"limit":10,"paginate":"offset","skip":0,"sort":"id"}'
+    )
+    assert response.status_code == 200
+    assert response.json() == cached
+    mock_redis.setex.assert_not_called()
+
+@pytest.mark.asyncio
+@patch("app.cache.redis_client")
+async def test_cache_coalesces_concurrent_misses(mock_redis):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    calls = 0
+
+    @cache(timeout=60, key_params=("page",))
+    async def load(page: int, db=None):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return JSONBytesResponse([page])
+
+    responses = await asyncio.gather(*(load(page=1, db=object()) for _ in range(10)))
+    assert calls == 1
+    assert all(r.body == b"[1]" for r in responses)
+    mock_redis.setex.assert_called_once()
+
+@pytest.mark.asyncio
+@patch("app.cache.redis_client")
+async def test_cache_rejects_unserialized_results(mock_redis):
+    mock_redis.get = AsyncMock(return_value=None)
+
+    @cache(timeout=60)
+    async def load(db=None):
+        return [{"id": 1}]
+
+    with pytest.raises(TypeError):
+        await load(db=object())
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_first_caller_cancellation():
+    calls = 0
+
+    async def fill():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"payload"
+
+    first = asyncio.create_task(single_flight("k", fill))
+    second = asyncio.create_task(single_flight("k", fill))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == b"payload"
+    assert first.cancelled()
+    assert calls == 1
+
+@patch("app.cache.redis_client")
+def test_get_products_served_from_local_cache(mock_redis, setup_database, test_products):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    first = client.get("/products/?skip=0&limit=2")
+    second = client.get("/products/?skip=0&limit=2")
+    assert second.json() == first.json()
+    # 第一次請求讀取命名空間版本與快取鍵，第二次完全由行程內快取回應
+    assert mock_redis.get.call_count == 2
+
+@patch("app.cache.redis_client")
+def test_clear_cache_invalidates_local_cache(mock_redis, setup_database, admin_user):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    mock_redis.publish = AsyncMock()
+    mock_redis.incr = AsyncMock(return_value=1)
+    assert client.get("/products/").json() == []
+    client.post(
+        "/products/",
+        json={"name": "測試產品", "description": "這是一個測試產品", "price": 100.0, "stock": 10},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    assert len(client.get("/products/").json()) == 1
+    mock_redis.incr.assert_called_once_with("cache:ns:products")
+
+def test_namespace_version_never_regresses():
+    local_cache.clear()
+    remember_namespace_version("cache:ns:products", 6)
+    # 亂序抵達的舊版本通知不會讓 worker 回到舊版本
+    remember_namespace_version("cache:ns:products", 5)
+    assert local_cache.get("cache:ns:products") == b"6"
+    remember_namespace_version("cache:ns:products", 7)
+    assert local_cache.get("cache:ns:products") == b"7"
+
+def test_local_cache_evicts_least_recently_used():
+    lru = LocalCache(max_entries=2, max_bytes=10)
+    lru.set("a", b"1", ttl=60)
+    lru.set("b", b"2", ttl=60)
+    assert lru.get("a") == b"1"
+    lru.set("c", b"3", ttl=60)
+    assert lru.get("b") is None
+    lru.set("d", b"123456789", ttl=60)
+    assert lru.get("a") is None and lru.size == 10
+    lru.set("e", b"x", ttl=0)
+    assert lru.get("e") is None and lru.get("c") is None
+    assert len(lru) == 1 and lru.size == 9
+
+@patch("app.cache.redis_client")
+def test_read_product_is_cached(mock_redis, setup_database, test_products):
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.setex = AsyncMock()
+    response = client.get("/products/1")
+    assert response.status_code == 200
+    key, timeout, payload = mock_redis.setex.call_args.args
+    assert key == "app.api.products:product:1"
+    assert json.loads(payload) == response.json()
+
+@patch("app.cache.redis_client")
+def test_read_product_negative_cache(mock_redis, setup_database):
+    mock_redis.get = AsyncMock(return_value=b"null")
+    response = client.get("/products/12345")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "產品不存在"
+
+@patch("app.cache.redis_client")
+def test_update_product_invalidates_only_that_product(mock_redis, setup_database, admin_user, test_products):
+    mock_redis.incr = AsyncMock(return_value=1)
+    mock_redis.publish = AsyncMock()
+    mock_redis.delete = AsyncMock()
+    response = client.put(
+        "/products/2",
+        json={"name": "更新產品", "description": "更新描述", "price": 150.0, "stock": 5},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    assert response.status_code == 200
+    mock_redis.delete.assert_called_once_with("app.api.products:product:2")
+
+@patch("app.cache.redis_client")
+def test_get_products_batch(mock_redis, setup_database, test_products):
+    cached = {"id": 3, "name": "快取產品", "description": None, "price": 10.0, "stock": 1, "image_url": None}
+    mock_redis.mget = AsyncMock(return_value=[None, json.dumps(cached).encode(), None, b"null"])
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    mock_redis.pipeline = MagicMock()
+    mock_redis.pipeline.return_value.__aenter__.return_value = pipe
+    response = client.get("/products/batch?ids=4,3,999,1000,4")
+    assert response.status_code == 200
+    data = response.json()
+    assert [product["id"] for product in data] == [4, 3]
+    assert data[1]["name"] == "快取產品"
+    mock_redis.mget.assert_called_once_with([
+        "app.api.products:product:4",
+        "app.api.products:product:3",
+        "app.api.products:product:999",
+        "app.api.products:product:1000",
+    ])
+    # 未命中的 ID 以單一查詢補齊，並連同負向快取一次寫回
+    stored = {call.args[0]: call.args[2] for call in pipe.setex.call_args_list}
+    assert json.loads(stored["app.api.products:product:4"])["name"] == "產品 4"
+    assert stored["app.api.products:product:999"] == b"null"
+    pipe.execute.assert_called_once()
+
+def test_get_products_batch_limit(setup_database):
+    response = client.get("/products/batch?ids=" + ",".join(str(i) for i in range(101)))
+    assert response.status_code == 400
+    response = client.get("/products/batch?ids=1,abc")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "產品 ID 格式錯誤"
+
+def test_get_products_cursor_pagination(setup_database, test_products):
+    response = client.get("/products/?paginate=cursor&limit=2")
+    assert response.status_code == 200
+    page = response.json()
+    assert [product["name"] for product in page["items"]] == ["產品 1", "產品 2"]
+    seen = page["items"]
+    while page["next_cursor"]:
+        page = client.get(f"/products/?after={page['next_cursor']}&limit=2").json()
+        seen += page["items"]
+    assert [product["id"] for product in seen] == [1, 2, 3, 4, 5]
+
+def test_get_products_cursor_pagination_by_price(setup_database, test_products):
+    page = client.get("/products/?paginate=cursor&sort=price&limit=3").json()
+    assert [product["price"] for product in page["items"]] == [100.0, 200.0, 300.0]
+    page = client.get(f"/products/?after={page['next_cursor']}&sort=price&limit=3").json()
+    assert [product["price"] for product in page["items"]] == [400.0, 500.0]
+    assert page["next_cursor"] is None
+
+def test_get_products_invalid_cursor(setup_database, test_products):
+    page = client.get("/products/?paginate=cursor&sort=price&limit=1").json()
+    response = client.get(f"/products/?after={page['next_cursor']}&sort=name")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "游標格式錯誤"
+    response = client.get("/products/?after=not-a-cursor")
+    assert response.status_code == 400
+    # 格式正確但排序鍵值型別錯誤的游標
+    for sort, value in [("price", {"a": 1}), ("price", "10"), ("price", True), ("name", 1)]:
+        response = client.get(f"/products/?sort={sort}&after={encode_cursor(sort, value, 1)}")
+        assert response.status_code == 400
+        assert response.json()["detail"] == "游標格式錯誤"
+
+def test_search_products_full_text(setup_database, admin_user):
+    for name, description in [
+        ("Wireless Mouse", "Ergonomic mouse with USB receiver"),
+        ("Mechanical Keyboard", "Keyboard with wireless mode"),
+        ("USB Cable", None),
+    ]:
+        client.post(
+            "/products/",
+            json={"name": name, "description": description, "price": 10.0, "stock": 1},
+            headers={"Authorization": f"Bearer {admin_user['token']}"}
+        )
+    data = client.get("/products/search?name=wire").json()
+    assert {product["name"] for product in data} == {"Wireless Mouse", "Mechanical Keyboard"}
+    data = client.get("/products/search?name=usb").json()
+    assert {product["name"] for product in data} == {"Wireless Mouse", "USB Cable"}
+    data = client.get("/products/search?name=usb cab").json()
+    assert [product["name"] for product in data] == ["USB Cable"]
+    assert len(client.get("/products/search?name=").json()) == 3
+
+def test_search_products_cjk_substring(setup_database, admin_user):
+    for name, description in [
+        ("無線藍牙耳機", "降噪"),
+        ("藍牙喇叭", "防水"),
+        ("有線耳機", "附收納袋，適合藍牙轉接"),
+    ]:
+        client.post(
+            "/products/",
+            json={"name": name, "description": description, "price": 10.0, "stock": 1},
+            headers={"Authorization": f"Bearer {admin_user['token']}"}
+        )
+    data = client.get("/products/search?name=無線").json()
+    assert [product["name"] for product in data] == ["無線藍牙耳機"]
+    data = client.get("/products/search?name=耳機").json()
+    assert {product["name"] for product in data} == {"無線藍牙耳機", "有線耳機"}
+    # 名稱符合者排在只有描述符合者之前
+    data = client.get("/products/search?name=藍牙").json()
+    assert [product["name"] for product in data] == ["無線藍牙耳機", "藍牙喇叭", "有線耳機"]
+    data = client.get("/products/search?name=藍牙 防水").json()
+    assert [product["name"] for product in data] == ["藍牙喇叭"]
+    assert client.get("/products/search?name=藍牙 降噪 wire").json() == []
+    data = client.get("/products/search?name=耳機&sort=name").json()
+    assert len(data) == 2
+
+def test_search_index_follows_updates(setup_database, admin_user):
+    response = client.post(
+        "/products/",
+        json={"name": "Desk Lamp", "description": "LED", "price": 10.0, "stock": 1},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    product_id = response.json()["id"]
+    client.put(
+        f"/products/{product_id}",
+        json={"name": "Floor Lamp", "description": "LED", "price": 10.0, "stock": 1},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    assert client.get("/products/search?name=desk").json() == []
+    assert len(client.get("/products/search?name=floor").json()) == 1
+    client.delete(f"/products/{product_id}", headers={"Authorization": f"Bearer {admin_user['token']}"})
+    assert client.get("/products/search?name=floor").json() == []
+
+def test_search_products_fuzzy(setup_database, admin_user):
+    for name in ["Wireless Mouse", "Mechanical Keyboard", "Monitor Stand"]:
+        client.post(
+            "/products/",
+            json={"name": name, "description": None, "price": 10.0, "stock": 1},
+            headers={"Authorization": f"Bearer {admin_user['token']}"}
+        )
+    assert client.get("/products/search?name=mechanical keybaord").json() == []
+    data = client.get("/products/search?name=mechanical keybaord&mode=fuzzy").json()
+    assert [product["name"] for product in data] == ["Mechanical Keyboard"]
+    data = client.get("/products/search?name=monitr&mode=fuzzy").json()
+    assert [product["name"] for product in data] == ["Monitor Stand"]
+    data = client.get("/products/search?name=wireles mouse&mode=fuzzy").json()
+    assert data[0]["name"] == "Wireless Mouse"
+
+def test_search_products_fuzzy_follows_updates(setup_database, admin_user):
+    response = client.post(
+        "/products/",
+        json={"name": "Desk Lamp", "description": None, "price": 10.0, "stock": 1},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    product_id = response.json()["id"]
+    assert len(client.get("/products/search?name=dsk lamp&mode=fuzzy").json()) == 1
+    client.put(
+        f"/products/{product_id}",
+        json={"name": "Floor Light", "description": None, "price": 10.0, "stock": 1},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    assert client.get("/products/search?name=dsk lamp&mode=fuzzy").json() == []
+    assert len(client.get("/products/search?name=flor light&mode=fuzzy").json()) == 1
+
+def test_trigram_index_similarity():
+    index = TrigramIndex()
+    index.add(1, "word")
+    index.add(2, "two words")
+    # 與 pg_trgm 相同："word" 與 "words" 的相似度為 4/7
+    results = dict(index.search("words", threshold=0))
+    assert results[1] == pytest.approx(4 / 7)
+    assert results[2] > results[1]
+    index.remove(2)
+    assert [product_id for product_id, _ in index.search("words")] == [1]
+
+def test_suggest_products(setup_database, admin_user):
+    for name in ["Wireless Mouse", "Wireless Keyboard", "Mouse Pad"]:
+        client.post(
+            "/products/",
+            json={"name": name, "description": None, "price": 10.0, "stock": 1},
+            headers={"Authorization": f"Bearer {admin_user['token']}"}
+        )
+    data = client.get("/products/suggest?q=wire").json()
+    assert [suggestion["name"] for suggestion in data] == ["Wireless Keyboard", "Wireless Mouse"]
+    data = client.get("/products/suggest?q=mou").json()
+    assert {suggestion["name"] for suggestion in data} == {"Mouse Pad", "Wireless Mouse"}
+    assert client.get("/products/suggest?q=").json() == []
+    client.delete("/products/3", headers={"Authorization": f"Bearer {admin_user['token']}"})
+    data = client.get("/products/suggest?q=mou").json()
+    assert [suggestion["name"] for suggestion in data] == ["Wireless Mouse"]
+
+def test_prefix_index():
+    index = PrefixIndex()
+    index.add(1, "Desk Lamp")
+    index.add(2, "Desk Chair")
+    assert index.search("desk", limit=1) == [(2, "Desk Chair")]
+    index.add(2, "Office Chair")
+    assert index.search("de", limit=10) == [(1, "Desk Lamp")]
+    assert index.search("ch", limit=10) == [(2, "Office Chair")]
+    index.remove(1)
+    assert index.search("l", limit=10) == []
+
+def test_get_product_conditional_request(setup_database, admin_user):
+    product_id = client.post(
+        "/products/",
+        json={"name": "測試產品", "price": 100.0, "stock": 10},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    ).json()["id"]
+    response = client.get(f"/products/{product_id}")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert "stale-while-revalidate" in response.headers["Cache-Control"]
+
+    response = client.get(f"/products/{product_id}", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    client.put(
+        f"/products/{product_id}",
+        json={"name": "測試產品", "price": 120.0, "stock": 10},
+        headers={"Authorization": f"Bearer {admin_user['token']}"}
+    )
+    response = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["price"] == 120.0
+
+def test_get_products_conditional_request(setup_database, test_products):
+    response = client.get("/products/?limit=3")
+    etag = response.headers["ETag"]
+    response = client.get("/products/?limit=3", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = client.get("/products/?limit=4", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 4
+
+@pytest.mark.asyncio
+async def test_name_index_rebuild_swaps_in_new_index(setup_database):
+    db = TestingSessionLocal()
+    db.add_all([Product(name=name, price=10.0, stock=1) for name in ["Desk Lamp", "Desk Chair"]])
+    db.commit()
+    db.close()
+    index = PrefixIndex()
+    index.add(99, "Stale Desk")
+    build = index._build
+
+    def build_during_update(rows):
+        # 重建期間的即時更新須在新索引換上後保留
+        index.add(3, "Desk Fan")
+        return build(rows)
+
+    with patch.object(index, "_build", build_during_update):
+        async with TestingAsyncSessionLocal() as session:
+            await index.rebuild(session)
+    assert index.search("desk", limit=10) == [(2, "Desk Chair"), (3, "Desk Fan"), (1, "Desk Lamp")]
+    assert index._keys == sorted(index._keys)
+    trigram = TrigramIndex()
+    async with TestingAsyncSessionLocal() as session:
+        await trigram.rebuild(session)
+    assert [product_id for product_id, _ in trigram.search("dsk lamp")] == [1]
+
+@pytest.mark.asyncio
+async def test_apply_similarity_threshold_is_transaction_local():
+    db = MagicMock(execute=AsyncMock())
+    await apply_similarity_threshold(db, 0.2)
+    statement = db.execute.await_args.args[0]
+    compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    assert str(compiled) == "SELECT set_config('pg_trgm.similarity_threshold', '0.2', true) AS set_config_1"
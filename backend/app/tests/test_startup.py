@@ -0,0 +1,59 @@
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+# 匯入 app.main 的累計時間上限（毫秒），CI 機器較慢時可透過環境變數放寬
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 2500))
+
+def run_python(*args, **env):
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env={
+            **os.environ,
+            "SECRET_KEY": "test-secret",
+            "FRONTEND_URL": "http://localhost:5173",
+            # 指向未使用的埠，確保匯入與啟動不依賴 Redis
+            "REDIS_PORT": "6390",
+            **env,
+        },
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+def test_import_defers_heavy_modules_and_connections():
+    result = run_python("-c", (
+        "import sys, app.main\n"
+        "print(','.join(m for m in ('passlib.context', 'jose', 'bcrypt') if m in sys.modules))"
+    ))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+    assert "never awaited" not in result.stderr
+    assert "Redis connection failed" not in result.stdout
+
+def test_import_time_budget():
+    result = run_python("-X", "importtime", "-c", "import app.main")
+    assert result.returncode == 0, result.stderr
+    line = next(line for line in result.stderr.splitlines() if line.rstrip().endswith("| app.main"))
+    cumulative_us = int(line.split("|")[1])
+    assert cumulative_us < IMPORT_TIME_BUDGET_MS * 1000
+
+def test_lifespan_starts_and_closes_resources(tmp_path):
+    result = run_python("-c", (
+        "from fastapi.testclient import TestClient\n"
+        "from app.main import app\n"
+        "from app.api import auth\n"
+        "from app.database import engine\n"
+        "with TestClient(app) as client:\n"
+        "    assert client.get('/').status_code == 200\n"
+        "    auth.get_password_executor()\n"
+        "assert auth._password_executor is None\n"
+        "assert engine.sync_engine.pool.checkedout() == 0\n"
+        "print('ok')"
+    ), DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}", DB_CREATE_ALL="true")
+    assert result.returncode == 0, result.stderr
+    assert "Redis connection failed, caching disabled" in result.stdout
+    assert result.stdout.strip().endswith("ok")
@@ -0,0 +1,77 @@
+"""中介層基準測試：比較 /products/ 回應經過 BaseHTTPMiddleware 與純 ASGI 中介層的每秒請求數。
+
+端點直接回傳預先序列化的產品列表（等同快取命中），只量測中介層本身的成本。
+執行方式（於 backend 目錄）::
+
+    python -m benchmarks.middleware [請求數]
+"""
+from fastapi import FastAPI
+import httpx
+from app.middleware import CompressionMiddleware, SecurityHeadersMiddleware
+from app.records import ProductRecord
+from app.responses import JSONBytesResponse
+import asyncio
+import sys
+import time
+
+SECURITY_HEADERS = {
+    "Content-Security-Policy": (
+        "default-src 'self'; "
+        "img-src 'self' https://via.placeholder.com; "
+        "style-src 'self' 'unsafe-inline'; "
+        "script-src 'self' 'unsafe-inline'"
+    ),
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+}
+
+def build_app(page_size: int, variant: str) -> FastAPI:
+    app = FastAPI()
+    payload = JSONBytesResponse([
+        ProductRecord(i, f"產品 {i}", f"第 {i} 個產品的描述文字", 10.0 + i, i % 50, None) for i in range(page_size)
+    ]).body
+
+    @app.get("/products/")
+    async def get_products():
+        return JSONBytesResponse(payload)
+
+    if variant == "http":
+        # 原本 app/main.py 的寫法
+        @app.middleware("http")
+        async def add_security_headers(request, call_next):
+            response = await call_next(request)
+            response.headers["Content-Security-Policy"] = (
+                "default-src 'self'; "
+                "img-src 'self' https://via.placeholder.com; "
+                "style-src 'self' 'unsafe-inline'; "
+                "script-src 'self' 'unsafe-inline'"
+            )
+            response.headers["X-Content-Type-Options"] = "nosniff"
+            response.headers["X-Frame-Options"] = "DENY"
+            return response
+    else:
+        if variant == "asgi+gzip":
+            app.add_middleware(CompressionMiddleware)
+        app.add_middleware(SecurityHeadersMiddleware, headers=SECURITY_HEADERS)
+    return app
+
+async def requests_per_second(app: FastAPI, requests: int, accept_encoding: str) -> tuple[float, int]:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Accept-Encoding": accept_encoding}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Content-Length 為實際傳輸（壓縮後）的位元組數
+        size = int((await client.get("/products/", headers=headers)).headers["content-length"])
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/products/", headers=headers)
+        return requests / (time.perf_counter() - start), size
+
+async def main(requests: int):
+    print(f"{'rows':>6} {'variant':<12} {'req/s':>10} {'bytes':>8}")
+    for page_size in (10, 100):
+        for variant, accept_encoding in (("http", "identity"), ("asgi", "identity"), ("asgi+gzip", "gzip")):
+            rate, size = await requests_per_second(build_app(page_size, variant), requests, accept_encoding)
+            print(f"{page_size:>6} {variant:<12} {rate:>10.0f} {size:>8}")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
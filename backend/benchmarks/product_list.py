@@ -0,0 +1,80 @@
+"""產品列表序列化基準測試：ORM + response_model + 標準 JSON 編碼器 vs Core 欄位 + slots 紀錄 + orjson。
+
+執行方式（於 backend 目錄）::
+
+    python -m benchmarks.product_list [重複次數]
+"""
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from app.database import Base
+from app.models.product import Product as ProductModel
+from app.records import PRODUCT_COLUMNS, product_records
+from app.responses import JSONBytesResponse
+from app.schemas.product import Product
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+PAGE_SIZES = (10, 100, 1000)
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), "vuefastmart_bench_product_list.db")
+
+def prepare_database():
+    engine = create_engine(f"sqlite:///{DATABASE_PATH}")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(ProductModel.__table__.insert(), [
+            {
+                "name": f"產品 {i}",
+                "description": f"第 {i} 個產品的描述文字",
+                "price": 10.0 + i,
+                "stock": i % 50,
+                "image_url": f"https://via.placeholder.com/{i}",
+            }
+            for i in range(max(PAGE_SIZES))
+        ])
+    engine.dispose()
+
+async def orm_path(db, limit: int, adapter: TypeAdapter) -> bytes:
+    """原本的路徑：載入 ORM 物件，經 response_model 驗證後以 jsonable_encoder + json 序列化。"""
+    products = (await db.scalars(select(ProductModel).order_by(ProductModel.id).limit(limit))).all()
+    validated = adapter.validate_python(products, from_attributes=True)
+    # 每個請求使用新的 session，不讓下一次迭代重用 identity map 中已載入的物件
+    db.expunge_all()
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False).encode()
+
+async def core_path(db, limit: int) -> bytes:
+    """快速路徑：只選取需要的欄位，轉為 slots 紀錄後由 orjson 序列化。"""
+    records = product_records(await db.execute(select(*PRODUCT_COLUMNS).order_by(ProductModel.id).limit(limit)))
+    return JSONBytesResponse(records).body
+
+async def measure(fill, repeat: int) -> float:
+    await fill()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fill()
+    return (time.perf_counter() - start) / repeat
+
+async def main(repeat: int):
+    prepare_database()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}", poolclass=NullPool)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    adapter = TypeAdapter(list[Product])
+    print(f"{'rows':>6} {'orm µs/row':>12} {'core µs/row':>12} {'speedup':>8}")
+    async with session_factory() as db:
+        for limit in PAGE_SIZES:
+            assert json.loads(await orm_path(db, limit, adapter)) == json.loads(await core_path(db, limit))
+            orm = await measure(lambda: orm_path(db, limit, adapter), repeat)
+            core = await measure(lambda: core_path(db, limit), repeat)
+            print(f"{limit:>6} {orm / limit * 1e6:>12.2f} {core / limit * 1e6:>12.2f} {orm / core:>7.1f}x")
+    await engine.dispose()
+    os.remove(DATABASE_PATH)
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
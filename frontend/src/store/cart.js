@@ -1,21 +1,38 @@
 import { defineStore } from 'pinia'
 import axios from 'axios'
 
+const GUEST_CART_KEY = 'guestCartId'
+
+// 未登入時購物車存於後端 Redis，以 X-Guest-Cart-Id 識別
+const requestConfig = () => {
+  const token = localStorage.getItem('token')
+  if (token) return { url: '/api/cart/', headers: { Authorization: `Bearer ${token}` } }
+  const guestCartId = localStorage.getItem(GUEST_CART_KEY)
+  return {
+    url: '/api/cart/guest/',
+    headers: guestCartId ? { 'X-Guest-Cart-Id': guestCartId } : {},
+    guest: true,
+  }
+}
+
 export const useCartStore = defineStore('cart', {
   state: () => ({
     items: [],
+    summary: null,
   }),
   actions: {
     async addItem({ product_id, quantity }) {
       try {
-        const token = localStorage.getItem('token')
-        if (!token) throw new Error('請先登入')
-        const response = await axios.post(
-          '/api/cart/',
-          { product_id, quantity },
-          { headers: { Authorization: `Bearer ${token}` } }
-        )
-        this.items.push(response.data)
+        const { url, headers, guest } = requestConfig()
+        const response = await axios.post(url, { product_id, quantity }, { headers })
+        if (guest) {
+          localStorage.setItem(GUEST_CART_KEY, response.data.cart_id)
+          this.items = response.data.items
+        } else {
+          this.items = this.items.filter(item => item.id !== response.data.id)
+          this.items.push(response.data)
+        }
+        await this.fetchSummary()
       } catch (error) {
         console.error('加入購物車失敗:', error)
         throw error
@@ -23,12 +40,10 @@ export const useCartStore = defineStore('cart', {
     },
     async removeItem(id) {
       try {
-        const token = localStorage.getItem('token')
-        if (!token) throw new Error('請先登入')
-        await axios.delete(`/api/cart/${id}`, {
-          headers: { Authorization: `Bearer ${token}` },
-        })
+        const { url, headers } = requestConfig()
+        await axios.delete(`${url}${id}`, { headers })
         this.items = this.items.filter(item => item.id !== id)
+        await this.fetchSummary()
       } catch (error) {
         console.error('移除失敗:', error)
         throw error
@@ -36,16 +51,48 @@ export const useCartStore = defineStore('cart', {
     },
     async fetchCart() {
       try {
-        const token = localStorage.getItem('token')
-        if (!token) throw new Error('請先登入')
-        const response = await axios.get('/api/cart/', {
-          headers: { Authorization: `Bearer ${token}` },
-        })
-        this.items = response.data
+        const { url, headers, guest } = requestConfig()
+        const response = await axios.get(url, { headers })
+        this.items = guest ? response.data.items : response.data
       } catch (error) {
         console.error('無法獲取購物車:', error)
         throw error
       }
     },
+    // 登入使用者的項目數與總價由後端以 SQL 聚合計算並快取；購物車變更後由各 action 重新取得
+    async fetchSummary() {
+      const token = localStorage.getItem('token')
+      if (!token) {
+        this.summary = {
+          item_count: this.items.length,
+          total_quantity: this.items.reduce((sum, item) => sum + item.quantity, 0),
+          total_price: this.items.reduce((sum, item) => sum + item.product.price * item.quantity, 0),
+        }
+        return
+      }
+      try {
+        const response = await axios.get('/api/cart/summary', {
+          headers: { Authorization: `Bearer ${token}` },
+        })
+        this.summary = response.data
+      } catch (error) {
+        console.error('無法獲取購物車摘要:', error)
+      }
+    },
+    async mergeGuestCart() {
+      const guestCartId = localStorage.getItem(GUEST_CART_KEY)
+      const token = localStorage.getItem('token')
+      if (!guestCartId || !token) return
+      try {
+        const response = await axios.post('/api/cart/guest/merge', null, {
+          headers: { Authorization: `Bearer ${token}`, 'X-Guest-Cart-Id': guestCartId },
+        })
+        localStorage.removeItem(GUEST_CART_KEY)
+        this.items = response.data.items
+        await this.fetchSummary()
+      } catch (error) {
+        console.error('合併購物車失敗:', error)
+      }
+    },
   },
-})
\ No newline at end of file
+})